@@ -21,10 +21,28 @@ Descripción:
 Flujo de uso:
     df_preparado = preparar_df_alertas(df_pred)
     alertas = detectar_alertas(df_preparado)
+
+    # O directamente sobre arrays NumPy, sin DataFrame:
+    alertas = detectar_alertas_np(times, pred, tmin)
 """
 
+import numpy as np
 import pandas as pd
 
+# Columnas que pueden intervenir en las reglas de alertas.
+# Cualquier otra columna de df_pred se ignora durante la preparación.
+COLUMNAS_ALERTAS = [
+    "time",
+    "pred_hibrida",
+    "hibrido",
+    "temperature_2m_min",
+    "temperature_2m_mean",
+]
+
+# Plantillas de los mensajes de alerta (una por regla)
+_MSG_DESCENSO = " Descenso brusco de temperatura el {fecha}: {valor:.1f}°C"
+_MSG_HELADA = " Riesgo de heladas el {fecha}: {valor:.1f}°C"
+
 
 #-------------------------------------------------------------
 # PREPARAR DATAFRAME PARA ALERTAS
@@ -36,6 +54,7 @@ def preparar_df_alertas(df_pred):
     mínimas necesarias paa la detección de alertas.
     
     Operaciones realizadas
+        - Seleccionar solo las columnas que usan las reglas de alertas.
         - convertir 'time' a datetime y ordenar cronológicamente.
         - Crear 'pred_hibrida' si no existe (Fallback: columna 'hibrido').
         - Crear 'temperature_2m_min' si no existe (estimación: media -3ºC).
@@ -49,19 +68,36 @@ def preparar_df_alertas(df_pred):
             DataFrame preparado para la detección de alertas.
     """
 
-    # Se trabaja sobre una copia para no modificar el DataFrame original
-    df = df_pred.copy()
+    # ------------------------------------------------------------
+    # Selección de columnas (proyección)
+    # ------------------------------------------------------------
+    # Las reglas solo leen unas pocas columnas. Se descartan el resto antes
+    # de convertir y ordenar, para no copiar ni reordenar datos que no se usan.
+    columnas = [c for c in COLUMNAS_ALERTAS if c in df_pred.columns]
 
     # ------------------------------------------------------------
     # Normalización y ordenación temporal
     # ------------------------------------------------------------
     # Convierte la columna 'time' a formato datetime.
     # errors="coerce" convierte valores inválidos en NaT.
-    df["time"] = pd.to_datetime(df["time"], errors="coerce")
+    # Si ya es datetime no se vuelve a parsear; si son cadenas, se indica el
+    # formato ISO 8601 (el que usan Open-Meteo y SQLite) para usar el parser
+    # rápido de pandas, y cache=True reutiliza el resultado de fechas repetidas.
+    tiempo = df_pred["time"]
+    if not pd.api.types.is_datetime64_any_dtype(tiempo):
+        tiempo = pd.to_datetime(tiempo, format="ISO8601", errors="coerce", cache=True)
+
+    # assign() devuelve un DataFrame nuevo que solo reemplaza 'time', así que
+    # no hace falta copiar todo el DataFrame para proteger el original.
+    df = df_pred[columnas].assign(time=tiempo)
 
     # Ordena el DataFrame por fecha y reinicia el índice.
     # Esto es crítico para detectar tendencias y comparaciones temporales.
-    df = df.sort_values("time").reset_index(drop=True)
+    # Las predicciones suelen llegar ya ordenadas: en ese caso se evita la
+    # ordenación y solo se reinicia el índice.
+    if not df["time"].is_monotonic_increasing:
+        df = df.sort_values("time", kind="stable")
+    df = df.reset_index(drop=True)
 
     # ------------------------------------------------------------
     # Crear columna pred_hibrida si no existe
@@ -95,6 +131,30 @@ def preparar_df_alertas(df_pred):
 # DETECTAR ALERTAS
 # ============================================================
 
+def _mascara_descensos(vals, umbral=2.0):
+    """
+    Marca los días cuya temperatura cae al menos 'umbral' °C respecto al día
+    anterior.
+
+    La comparación se hace sobre el array completo: vals[1:] es "hoy" y
+    vals[:-1] es "ayer". El primer día no tiene día previo, por lo que
+    nunca se marca.
+
+    Parámetros:
+        vals: np.ndarray
+            Temperaturas ordenadas cronológicamente.
+        umbral: float
+            Caída mínima (°C) para considerar un descenso brusco.
+
+    Retorna:
+        np.ndarray[bool]
+            Máscara del mismo tamaño que vals.
+    """
+    mascara = np.zeros(len(vals), dtype=bool)
+    mascara[1:] = vals[1:] <= vals[:-1] - umbral
+    return mascara
+
+
 def detectar_alertas(df_pred):
     """
     Analiza un DataFrame de predicciones meteorológicas y genera alertas meteorológicas basadasen
@@ -106,10 +166,42 @@ def detectar_alertas(df_pred):
         2) Riesgo de heladas: 
             - Si la temperatura mínima < 3°C.
     
+    Extrae las columnas como arrays NumPy una sola vez y delega la 
+    evaluación en detectar_alertas_np().
+    
     Parámetros:
         df_pred: pd.DataFrame
             DataFrame preparado por preparar_df_alertas().
             
+    Retorna:
+        list[str]
+            Lista de mensajes de alertas generados.
+    """
+    return detectar_alertas_np(
+        df_pred["time"].to_numpy(),
+        df_pred["pred_hibrida"].to_numpy(),
+        df_pred["temperature_2m_min"].to_numpy(),
+    )
+
+
+def detectar_alertas_np(times, pred, tmin):
+    """
+    Versión de detectar_alertas() que trabaja directamente sobre arrays NumPy,
+    sin construir un DataFrame. Pensada para horizontes cortos de predicción,
+    donde el coste de pandas domina sobre el de las propias reglas.
+
+    Cada regla se evalúa como una máscara NumPy y solo se recorren los días
+    que la cumplen. Se devuelven primero todos los descensos bruscos y
+    después todas las heladas, cada grupo en orden cronológico.
+
+    Parámetros:
+        times: np.ndarray
+            Fechas (datetime64), ordenadas cronológicamente.
+        pred: np.ndarray
+            Temperatura predicha (pred_hibrida) para cada fecha.
+        tmin: np.ndarray
+            Temperatura mínima para cada fecha.
+
     Retorna:
         list[str]
             Lista de mensajes de alertas generados.
@@ -121,30 +213,19 @@ def detectar_alertas(df_pred):
     # ------------------------------------------------------------
     # 1) Descenso brusco de temperatura
     # ------------------------------------------------------------
-    # Se recorre desde el segundo registro para comparar con el anterior.
-    for i in range(1, len(df_pred)):
-        t_hoy = df_pred.loc[i, "pred_hibrida"]   # Temperatura del día actual
-        t_ayer = df_pred.loc[i - 1, "pred_hibrida"]  # Temperatura del día previo
-
-        # Si la temperatura cae 2°C o más, se genera una alerta
-        if t_hoy <= t_ayer - 2:
-            fecha = df_pred.loc[i, "time"].date()
-            alertas.append(
-                f" Descenso brusco de temperatura el {fecha}: {t_hoy:.1f}°C"
-            )
+    # Solo se recorren los índices donde se cumple la condición; las fechas
+    # de esos días se convierten a datetime.date en bloque.
+    indices = np.flatnonzero(_mascara_descensos(pred, umbral=2.0))
+    for i, fecha in zip(indices, pd.DatetimeIndex(times[indices]).date):
+        alertas.append(_MSG_DESCENSO.format(fecha=fecha, valor=pred[i]))
 
     # ------------------------------------------------------------
     # 2) Riesgo de heladas
     # ------------------------------------------------------------
-    # Se filtran los días con temperatura mínima inferior a 3°C
-    heladas = df_pred[df_pred["temperature_2m_min"] < 3]
-
-    # Por cada día con riesgo de helada, se genera una alerta
-    for _, row in heladas.iterrows():
-        fecha = row["time"].date()
-        alertas.append(
-            f" Riesgo de heladas el {fecha}: {row['pred_hibrida']:.1f}°C"
-        )
+    # Máscara de días con temperatura mínima inferior a 3°C
+    indices = np.flatnonzero(tmin < 3)
+    for i, fecha in zip(indices, pd.DatetimeIndex(times[indices]).date):
+        alertas.append(_MSG_HELADA.format(fecha=fecha, valor=pred[i]))
 
     # Devuelve la lista de alertas generadas
     return alertas
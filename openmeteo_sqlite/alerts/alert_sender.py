@@ -12,33 +12,64 @@ Descripción:
 
 Funcionamiento:
     - Si no hay alertas, no se envía nada.
-    - Se construye un mensaje único con todas las alertas.
+    - Se construye un mensaje único con todas las alertas (en Telegram se
+      divide en bloques si supera el límite de longitud de un mensaje).
     - Si TELEGRAM_ENABLED=True -> se envía por Telegram.
     - SI ALARM_EMAIL_ENABLED=True -> se envía por Email.
+    - Si ambos canales están activos, los envíos se hacen en paralelo.
     
 Requisitos:
     - Variables de entorno configuradas en .env:
         TELEGRAM_ENABLED=True/False
         ALARM_EMAIL_ENABLED=True/False
     Módulos:
-        alerts.telegram.enviar_telegram()
+        alerts.telegram.enviar_telegram_batch()
         alerts.email.enviar_email()
 """
 
+import logging
 import os
-from alerts.telegram import enviar_telegram
+from concurrent.futures import ThreadPoolExecutor
+
+from alerts.telegram import enviar_telegram_batch
 from alerts.email import enviar_email
 
+# Logger del módulo. Los handlers se configuran en el punto de entrada
+# (main.py, check_alerts.py), no aquí.
+logger = logging.getLogger(__name__)
+
+#----------------------------------------------------------------------
+# Configuración de canales (leída una sola vez al importar)
+#----------------------------------------------------------------------
+# Las variables de entorno se comparan como string porque siempre son texto.
+# telegram.py y email.py ya han cargado el .env al importarse.
+_TELEGRAM_ON = os.getenv("TELEGRAM_ENABLED", "False") == "True"
+_EMAIL_ON = os.getenv("ALARM_EMAIL_ENABLED", "False") == "True"
+
+
+def reload_env():
+    """
+    Vuelve a leer TELEGRAM_ENABLED y ALARM_EMAIL_ENABLED del entorno.
+
+    Útil si las variables cambian después de importar el módulo
+    (por ejemplo, en pruebas).
+    """
+    global _TELEGRAM_ON, _EMAIL_ON
+    _TELEGRAM_ON = os.getenv("TELEGRAM_ENABLED", "False") == "True"
+    _EMAIL_ON = os.getenv("ALARM_EMAIL_ENABLED", "False") == "True"
+
 
 def enviar_alertas(alertas):
     """
     Envía una lista de alertas a los canales configurados.
     
     Flujo:
-        1. Validación: si no hay alertas, se aborta el envío.
-        2. CONstrucción de un único mensaje con todas las alertas.
-        3. Envío por Telegram si TELEGRAM_ENABLED=True.
-        4. Envío por Email si ALARM_EMAIL_ENABLED=True.
+        1. Validación: si no hay alertas o no hay ningún canal activo,
+           se aborta el envío.
+        2. Selección de canales: Telegram si TELEGRAM_ENABLED=True,
+           Email si ALARM_EMAIL_ENABLED=True (con un único mensaje que
+           reúne todas las alertas).
+        3. Envío simultáneo por todos los canales activos.
         
     Parámetros:
         alertas: lis[str]
@@ -53,33 +84,50 @@ def enviar_alertas(alertas):
     #  1. Validación: si no hay alertas, no se envía nada 
     #-------------------------------------------------------------
     if not alertas:
-        print("No hay alertas que enviar.")
+        logger.info("No hay alertas que enviar.")
         return
 
-    #------------------------------------------------------------- 
-    # 2. Construcción del mensaje final 
-    #-------------------------------------------------------------
-    mensaje = "\n".join(alertas)
+    # Sin canales activos no hay nada que construir ni enviar
+    if not (_TELEGRAM_ON or _EMAIL_ON):
+        logger.info("Telegram y Email deshabilitados en .env")
+        return
 
     #----------------------------------------------------------------------
-    # 3. Envío por Telegram
+    # 2. Selección de canales activos
     #----------------------------------------------------------------------
-    # La variable de entorno TELEGRAM_ENABLED controla si se envía o no.
-    # Se compara como string porque las varibañes de entorno siempre son texto.
-    
-    if os.getenv("TELEGRAM_ENABLED", "False") == "True":
-        print("📨 Enviando alertas por Telegram...")
-        enviar_telegram(mensaje)
+    # TELEGRAM_ENABLED y ALARM_EMAIL_ENABLED controlan qué canales se usan.
+    tareas = []
+
+    if _TELEGRAM_ON:
+        logger.info("📨 Enviando alertas por Telegram...")
+        tareas.append((enviar_telegram_batch, (alertas,)))
     else:
-        print("Telegram deshabilitado en .env")
+        logger.info("Telegram deshabilitado en .env")
+
+    if _EMAIL_ON:
+        logger.info("📧 Enviando alertas por Email...")
+        # El email lleva todas las alertas en un único mensaje
+        mensaje = "\n".join(alertas)
+        tareas.append((enviar_email, ("⚠️ Alertas meteorológicas", mensaje)))
+    else:
+        logger.info("Email deshabilitado en .env")
 
     #----------------------------------------------------------------------
-    # 4. Envío por Email
+    # 3. Envío en paralelo
     #----------------------------------------------------------------------
-    # Similar al caso anterior, pero usando ALARM_EMAIL_ENABLED.
-    
-    if os.getenv("ALARM_EMAIL_ENABLED", "False") == "True":
-        print("📧 Enviando alertas por Email...")
-        enviar_email("⚠️ Alertas meteorológicas", mensaje)
-    else:
-        print("Email deshabilitado en .env")
+    # Ambos envíos son E/S de red bloqueante, así que se lanzan en hilos:
+    # el tiempo total es el del canal más lento, no la suma de ambos.
+    with ThreadPoolExecutor(max_workers=len(tareas)) as executor:
+        list(executor.map(_ejecutar_envio, tareas))
+
+
+def _ejecutar_envio(tarea):
+    """
+    Ejecuta un envío (función, argumentos) aislando sus errores, para que el
+    fallo de un canal no impida el envío por el otro.
+    """
+    funcion, args = tarea
+    try:
+        funcion(*args)
+    except Exception as e:
+        logger.warning(f"⚠️ Error en el envío de alertas ({funcion.__name__}): {e}")
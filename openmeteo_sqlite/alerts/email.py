@@ -14,6 +14,7 @@ Funcionalidades:
     - carga de credenciales desde variables del entorno.
     - Construcción de mensajes MIME de texto plano.
     - Envío mediante SMTP seguro (SSL).
+    - Reutilización de una única conexión SMTP autenticada entre envíos.
     - Control de activación mediante ALARM_EMAIL_ENABLED.
     
 Requisitos en .env:
@@ -24,13 +25,129 @@ Requisitos en .env:
     SMTP_SERVER=stmp.gmail.com (por defecto)
     STMP_PORT=465 (por defecto)
 """
+import atexit
+import logging
 import os
 import smtplib
+import threading
 from email.mime.text import MIMEText
-from dotenv import load_dotenv
 
-# Carga las variables de entorno desde el archivo .env
-load_dotenv()
+# Al importar config se carga el archivo .env una única vez para todo el proyecto
+import config.config  # noqa: F401
+
+# Logger del módulo. Los handlers se configuran en el punto de entrada
+# (main.py, check_alerts.py), no aquí.
+logger = logging.getLogger(__name__)
+
+#----------------------------------------------------------------------------
+# Configuración SMTP (leída una sola vez al importar)
+#----------------------------------------------------------------------------
+_EMAIL_ON = os.getenv("ALARM_EMAIL_ENABLED", "False") == "True"
+_SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+_SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+
+
+def reload_env():
+    """
+    Vuelve a leer del entorno la activación del canal y la configuración SMTP.
+
+    Útil si las variables cambian después de importar el módulo
+    (por ejemplo, en pruebas).
+    """
+    global _EMAIL_ON, _SMTP_SERVER, _SMTP_PORT
+    _EMAIL_ON = os.getenv("ALARM_EMAIL_ENABLED", "False") == "True"
+    _SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+    _SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+
+
+#----------------------------------------------------------------------------
+# Conexión SMTP reutilizable
+#----------------------------------------------------------------------------
+class EmailSender:
+    """
+    Mantiene abierta una única conexión SMTP_SSL autenticada para enviar
+    varios correos sin repetir el handshake TLS ni el login en cada envío.
+
+    Uso:
+        with EmailSender(remitente, destinatario, password) as sender:
+            sender.send("Asunto 1", "Mensaje 1")
+            sender.send("Asunto 2", "Mensaje 2")
+
+    Si el servidor cierra la conexión entre envíos, send() reconecta
+    automáticamente una vez.
+    """
+
+    def __init__(self, remitente, destinatario, password,
+                 smtp_server=None, smtp_port=None):
+        self.remitente = remitente
+        self.destinatario = destinatario
+        self.password = password
+        self.smtp_server = smtp_server or _SMTP_SERVER
+        self.smtp_port = smtp_port or _SMTP_PORT
+        self._server = None
+
+    def conectar(self):
+        """Abre la conexión segura y se autentica con el remitente."""
+        self.cerrar()
+        server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
+        try:
+            server.login(self.remitente, self.password)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+
+    def cerrar(self):
+        """Cierra la conexión si está abierta, ignorando errores de red."""
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            self._server.close()
+        finally:
+            self._server = None
+
+    def send(self, asunto: str, mensaje: str) -> None:
+        """Envía un email de texto plano usando la conexión abierta."""
+        # MIMEText crea un email de texto plano con cabeceras estándar.
+        msg = MIMEText(mensaje)
+        msg["Subject"] = asunto
+        msg["From"] = self.remitente
+        msg["To"] = self.destinatario
+
+        if self._server is None:
+            self.conectar()
+        try:
+            self._server.sendmail(self.remitente, self.destinatario, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # El servidor cerró la conexión por inactividad: se reabre una vez
+            self.conectar()
+            self._server.sendmail(self.remitente, self.destinatario, msg.as_string())
+
+    def __enter__(self):
+        self.conectar()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cerrar()
+
+
+# Conexión compartida por las llamadas a enviar_email()
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def _cerrar_sender():
+    """Cierra la conexión compartida al terminar el proceso."""
+    global _sender
+    if _sender is not None:
+        _sender.cerrar()
+        _sender = None
+
+
+atexit.register(_cerrar_sender)
+
 
 #----------------------------------------------------------------------------
 # Función principal: envío de emails
@@ -41,9 +158,9 @@ def enviar_email(asunto: str, mensaje: str) -> None:
 
     Flujo:
         1. Verifica si el envío de email está habilitado.
-        2. Carga credenciales y configuración SMTP desde el entorno.
-        3. Construye en mensaje MIME.
-        4. Intenta enviar el correo usando SMTP_SSL.
+        2. Carga credenciales desde el entorno.
+        3. Reutiliza (o abre) la conexión SMTP_SSL compartida.
+        4. Envía el correo.
         5. Maneja errores comunes (autenticación, otros).
         
     Parámetros:
@@ -56,6 +173,7 @@ def enviar_email(asunto: str, mensaje: str) -> None:
         None
             No retorna nada; solo ejecuta el envío si está habilitado.
     """
+    global _sender
     
     #--------------------------------------------------------------------
     # 1. Verificar si el envío de email está habilitado
@@ -63,53 +181,51 @@ def enviar_email(asunto: str, mensaje: str) -> None:
     # La variable ALARM_EMAIL_ENABLED controla si se envían correos.
     # Si no está en "True", se aborta el envío.
     
-    if os.getenv("ALARM_EMAIL_ENABLED", "False") != "True":
-        print("📭 Email deshabilitado en .env")
+    if not _EMAIL_ON:
+        logger.info("📭 Email deshabilitado en .env")
         return
 
     #--------------------------------------------------------------------
-    # 2. Cargar credenciales y configuración SMTP
+    # 2. Cargar credenciales
     #--------------------------------------------------------------------
     remitente = os.getenv("ALARM_EMAIL_FROM")
     destinatario = os.getenv("ALARM_EMAIL_TO")
     password = os.getenv("ALARM_EMAIL_PASSWORD")
-    smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-    smtp_port = int(os.getenv("SMTP_PORT", "465"))
 
     # Validación básica de credenciales
     if not remitente or not destinatario or not password:
-        print("⚠️ Faltan credenciales de email en el .env")
+        logger.warning("⚠️ Faltan credenciales de email en el .env")
         return
 
-    #--------------------------------------------------------------------
-    # 3. Construcción del mensaje MIME
-    #--------------------------------------------------------------------
-    # MIMEText crea un email de texto plano con cabeceras estándar.
-    msg = MIMEText(mensaje)
-    msg["Subject"] = asunto
-    msg["From"] = remitente
-    msg["To"] = destinatario
+    with _sender_lock:
+        #----------------------------------------------------------------
+        # 3. Conexión compartida
+        #----------------------------------------------------------------
+        # Se crea la primera vez o si han cambiado las credenciales; en el
+        # resto de llamadas se reutiliza la misma sesión SMTP autenticada.
+        credenciales = (remitente, destinatario, password, _SMTP_SERVER, _SMTP_PORT)
+        if _sender is None or credenciales != (
+            _sender.remitente, _sender.destinatario, _sender.password,
+            _sender.smtp_server, _sender.smtp_port,
+        ):
+            _cerrar_sender()
+            _sender = EmailSender(remitente, destinatario, password)
 
-    #--------------------------------------------------------------------
-    # 4. Envío del email usando SMTP con SSL
-    #--------------------------------------------------------------------
-    try:
-        # Se abre una conexión segura cone l servidor SMTP
-        with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-            #Autenticación con las credenciales del remitente
-            server.login(remitente, password)
-            
-            # Envío del mensaje ya fromateado
-            server.sendmail(remitente, destinatario, msg.as_string())
-
-        print("📧 Email enviado correctamente")
+        #----------------------------------------------------------------
+        # 4. Envío del email
+        #----------------------------------------------------------------
+        try:
+            _sender.send(asunto, mensaje)
+            logger.info("📧 Email enviado correctamente")
 
-    #--------------------------------------------------------------------
-    # 5. Manejo de errores
-    #--------------------------------------------------------------------
-    except smtplib.SMTPAuthenticationError:
-        # Error típico cuando la contraseña/ token es incorrecto
-        print("❌ Error de autenticación SMTP.")
-    except Exception as e:
-        # Cualquier otro error inesperado
-        print(f"⚠️ Error enviando email: {e}")
+        #----------------------------------------------------------------
+        # 5. Manejo de errores
+        #----------------------------------------------------------------
+        except smtplib.SMTPAuthenticationError:
+            # Error típico cuando la contraseña/ token es incorrecto
+            logger.error("❌ Error de autenticación SMTP.")
+            _cerrar_sender()
+        except Exception as e:
+            # Cualquier otro error inesperado
+            logger.warning(f"⚠️ Error enviando email: {e}")
+            _cerrar_sender()
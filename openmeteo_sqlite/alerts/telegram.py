@@ -1,5 +1,5 @@
 """
-Módulo: email.py
+Módulo: telegram.py
 Proyecto: Sistema de Predicción Meteorológica Híbrida (OpeneMeteo_Sqlite)
 Autor: Tamara
 Descripción:
@@ -14,7 +14,13 @@ Funcionalidades:
     - Carga de creadenciales desde variables de entorno.
     - Construcciñon de peticiones HTTP POST a la API oficial de telegram.
     - Envío de mensajes de texto a un chat concreto.
+    - Agrupación de varias alertas en el mínimo número de mensajes.
+    - Reutilización de la conexión HTTP (keep-alive) entre envíos, con un
+      pool de urllib3 (sin la capa de requests, innecesaria para un único endpoint).
     - Interpretación de códigos de errores comunes ( 400, 401, 403).
+    - Reintentos con backoff exponencial ante fallos transitorios (429, 5xx, fallo al conectar).
+    - Clave de idempotencia por mensaje y día de envío para no repetir la misma alerta
+      en ejecuciones sucesivas.
     
 Requisitos en .env:
     TELEGRAM_BOT_TOKEN=token_del_bot
@@ -24,12 +30,102 @@ Requisitos en .env:
 Nota:
     El usuario debe haber pulsado START en el bot para permitir el envío.
 """
+import hashlib
+import json
+import logging
 import os
-import requests
+import random
+import sqlite3
+import time
+from datetime import date
+
+import urllib3
 from dotenv import load_dotenv
 
-# Carga las variables de entorno desde el archivo .env
-load_dotenv()
+# Al importar config se carga el archivo .env una única vez para todo el proyecto
+from config.config import ENV_PATH
+from db.database import liberar_envio_alerta, registrar_envio_alerta
+
+# Logger del módulo. Los handlers se configuran en el punto de entrada
+# (main.py, check_alerts.py), no aquí.
+logger = logging.getLogger(__name__)
+
+#----------------------------------------------------------------------------
+# Credenciales (leídas al importar y recargadas solo si cambia el .env)
+#----------------------------------------------------------------------------
+_BOT_TOKEN = None
+_CHAT_ID = None
+_URL = None
+
+
+def _mtime_env():
+    """Fecha de modificación del .env, o None si no existe."""
+    try:
+        return os.path.getmtime(ENV_PATH)
+    except OSError:
+        return None
+
+
+def _leer_credenciales():
+    """Lee token y chat_id del entorno y construye la URL del endpoint."""
+    global _BOT_TOKEN, _CHAT_ID, _URL
+    _BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+    _CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+
+    # Endpoint oficial para enviar mensajes
+    _URL = f"https://api.telegram.org/bot{_BOT_TOKEN}/sendMessage" if _BOT_TOKEN else None
+
+
+def _refrescar_credenciales():
+    """
+    Vuelve a cargar el .env solo si el archivo ha cambiado desde la última
+    lectura. En el caso habitual cuesta un stat() en lugar de un parseo.
+    """
+    global _env_mtime
+    mtime = _mtime_env()
+    if mtime != _env_mtime:
+        if mtime is not None:
+            load_dotenv(ENV_PATH, override=True)
+        _env_mtime = mtime
+        _leer_credenciales()
+
+
+_env_mtime = _mtime_env()
+_leer_credenciales()
+
+#----------------------------------------------------------------------------
+# Sesión HTTP (creada una sola vez al importar)
+#----------------------------------------------------------------------------
+
+# Longitud máxima por mensaje (Telegram admite 4096; se deja margen)
+_MAX_CARACTERES = 4000
+
+# Timeout de conexión y de lectura en segundos
+_TIMEOUT = urllib3.Timeout(connect=3.05, read=10)
+
+# Política de reintentos ante fallos transitorios
+_MAX_REINTENTOS = 3
+_ESPERA_BASE = 1.0       # segundos
+_ESPERA_MAXIMA = 30.0    # segundos
+_ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+# Pool compartido: reutiliza la conexión TCP+TLS (keep-alive) entre envíos
+# en lugar de abrir una nueva en cada mensaje. Es seguro entre hilos.
+# Los reintentos de urllib3 se desactivan porque se gestionan en
+# enviar_telegram() (backoff, Retry-After y clave de idempotencia).
+_HTTP = urllib3.PoolManager(num_pools=1, maxsize=4, retries=False)
+
+# Fallos al conectar: la petición no llegó a salir, así que reintentar no
+# puede duplicar el mensaje (NewConnectionError hereda de este error)
+_ERRORES_CONEXION = (urllib3.exceptions.ConnectTimeoutError,)
+
+# Fallos después de enviar la petición (respuesta perdida o cortada):
+# Telegram pudo haber entregado el mensaje, así que no se reintenta
+_ERRORES_RESPUESTA = (
+    urllib3.exceptions.ReadTimeoutError,
+    urllib3.exceptions.ProtocolError,
+)
+
 #----------------------------------------------------------------------------
 # Función principal: envío de mensajes a Telegram
 #----------------------------------------------------------------------------
@@ -39,11 +135,27 @@ def enviar_telegram(mensaje: str) -> None:
     Envía un mensaje de texto a un chat de Telegram usando la API oficial
 
     Flujo:
-        1. Cargar token y chat_id desde variables de entorno.
-        2. Validar que existen.
-        3. Construir la URL de la API y el payload.
-        4. Enviar el mensaje mediante POST.
-        5. Interpretar códigos de error comunes
+        1. Validar que existen token y chat_id (leídos al importar y
+           recargados solo si el .env ha cambiado).
+        2. Construir el payload.
+        3. Enviar el mensaje mediante POST con el pool HTTP compartido.
+        4. Interpretar códigos de error comunes
+        5. Reintentar con backoff exponencial cuando la petición no llegó
+           a Telegram (fallo al conectar), ante 429 o ante 5xx (respetando
+           retry_after cuando Telegram lo indica).
+
+    Telegram no ofrece idempotencia, así que se emula en local: cada mensaje
+    se identifica por su texto y la fecha de envío (hoy), y la clave se
+    registra en SQLite antes del envío. Si la clave ya existe, el mensaje se
+    da por enviado y no se repite; por tanto, un mismo texto solo se envía
+    una vez al día aunque check_alerts.py se ejecute varias veces.
+
+    Si la respuesta se pierde después de enviar la petición (timeout de
+    lectura, conexión cortada) no se reintenta, porque Telegram pudo haber
+    entregado ya el mensaje. En ese caso, y si se agotan los reintentos tras
+    un 5xx, la clave se conserva para que tampoco la reenvíe la siguiente
+    ejecución. Solo se libera cuando el envío se descarta con seguridad: un
+    rechazo 4xx de Telegram o fallos de conexión en todos los intentos.
         
     Parámetros:
         mensaje: str
@@ -55,54 +167,244 @@ def enviar_telegram(mensaje: str) -> None:
     """
     
     #----------------------------------------------------------------------------
-    # 1. Cargar credenciales desde el entorno
+    # 1. Comprobar credenciales
     #----------------------------------------------------------------------------
-    
-    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-    chat_id = os.getenv("TELEGRAM_CHAT_ID")
+
+    _refrescar_credenciales()
 
     # Validación básica: si falta token o chat_id, no se puede enviar nada
-    if not bot_token or not chat_id:
-        print("⚠️ Falta TELEGRAM_BOT_TOKEN o TELEGRAM_CHAT_ID en el .env")
+    if not _BOT_TOKEN or not _CHAT_ID:
+        logger.warning("⚠️ Falta TELEGRAM_BOT_TOKEN o TELEGRAM_CHAT_ID en el .env")
         return
 
     #--------------------------------------------------------------------------
     # 2. Construcción de la petición a la API  de Telegram
     #--------------------------------------------------------------------------
-    # Endpoint oficial para enviar mensajes
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    
     # Playload mínimo requerido por Telegram: chat_id + texto
-    payload = {"chat_id": chat_id, "text": mensaje}
+    payload = {"chat_id": _CHAT_ID, "text": mensaje}
+
+    # Clave de idempotencia: si ya se envió (o pudo enviarse) este mensaje
+    # hoy, no se vuelve a mandar.
+    fecha = date.today().isoformat()
+    clave = _clave_idempotencia(mensaje, fecha)
+    if not _registrar_envio(clave, fecha):
+        logger.info("⏭️ Mensaje ya enviado a Telegram hoy; se omite")
+        return
 
     #--------------------------------------------------------------------------
-    # 3. Envío del mensaje
+    # 3. Envío del mensaje (con reintentos ante fallos transitorios)
     #--------------------------------------------------------------------------
-    try:
-        resp = requests.post(url, data=payload)
-
-        #---------------------------------------------------------------------
-        # 4. Interpretación de respuestas HTTP
-        #---------------------------------------------------------------------
-        if resp.status_code == 200:
-            # Envío correcto
-            print("📨 Mensaje enviado a Telegram correctamente")
+    # Pasa a True si algún intento pudo llegar a Telegram sin confirmación
+    # (5xx); entonces la clave no se libera al agotar los reintentos.
+    entrega_incierta = False
+
+    for intento in range(_MAX_REINTENTOS + 1):
+        retry_after = None
+        try:
+            # request_encode_body codifica el payload como formulario
+            # (application/x-www-form-urlencoded), igual que la API espera.
+            resp = _HTTP.request_encode_body(
+                "POST", _URL, fields=payload,
+                encode_multipart=False, timeout=_TIMEOUT,
+            )
+
+        #----------------------------------------------------------------------
+        # 5. Manejo de errores de conexión
+        #----------------------------------------------------------------------
+        except _ERRORES_CONEXION as e:
+            # La petición no salió: se puede reintentar sin duplicar
+            logger.warning(f"⚠️ Error de conexión al enviar mensaje a Telegram: {e}")
+        except _ERRORES_RESPUESTA as e:
+            # La petición salió pero no hay respuesta: reintentar podría
+            # duplicar el mensaje, así que se da por enviado
+            logger.warning(f"⚠️ Sin respuesta de Telegram tras el envío: {e}")
+            logger.warning("   ➤ No se reintenta para no duplicar el mensaje")
+            return
+        except Exception as e:
+            # Cualquier otro error no se soluciona reintentando. No se sabe
+            # si la petición salió, así que la clave se conserva.
+            logger.warning(f"⚠️ Error al enviar mensaje a Telegram: {e}")
             return
 
-        # Errores comunes de la API
-        elif resp.status_code == 400:
-            print("❌ Error 400: CHAT_ID incorrecto")
-        elif resp.status_code == 401:
-            print("❌ Error 401: TOKEN incorrecto")
-        elif resp.status_code == 403:
-            print("❌ Error 403: El bot NO tiene permiso para escribirte")
-            print("   ➤ Abre Telegram y pulsa START en tu bot")
         else:
-            # Otros errores no contemplados explícitamente
-            print(f"⚠️ Error al enviar mensaje a Telegram: {resp.status_code} - {resp.text}")
+            #------------------------------------------------------------------
+            # 4. Interpretación de respuestas HTTP
+            #------------------------------------------------------------------
+            if resp.status == 200:
+                # Envío correcto
+                logger.info("📨 Mensaje enviado a Telegram correctamente")
+                return
 
-    #--------------------------------------------------------------------------
-    # 5. Manejo de errores de conexión
-    #--------------------------------------------------------------------------
-    except Exception as e:
-        print(f"⚠️ Error de conexión al enviar mensaje a Telegram: {e}")
+            # Errores comunes de la API (no recuperables: no se reintenta)
+            elif resp.status == 400:
+                logger.error("❌ Error 400: CHAT_ID incorrecto")
+                _liberar_envio(clave)
+                return
+            elif resp.status == 401:
+                logger.error("❌ Error 401: TOKEN incorrecto")
+                _liberar_envio(clave)
+                return
+            elif resp.status == 403:
+                logger.error("❌ Error 403: El bot NO tiene permiso para escribirte")
+                logger.error("   ➤ Abre Telegram y pulsa START en tu bot")
+                _liberar_envio(clave)
+                return
+            elif resp.status in _ESTADOS_REINTENTABLES:
+                # Límite de peticiones o error temporal del servidor. Un 429
+                # es un rechazo (el mensaje no se procesó); con un 5xx no se
+                # puede asegurar.
+                logger.warning(f"⚠️ Telegram respondió {resp.status}")
+                if resp.status != 429:
+                    entrega_incierta = True
+                if resp.status in (429, 503):
+                    retry_after = _leer_retry_after(resp)
+            else:
+                # Otros errores no contemplados explícitamente (rechazos 4xx)
+                logger.warning(f"⚠️ Error al enviar mensaje a Telegram: {resp.status} - {resp.data.decode(errors='replace')}")
+                _liberar_envio(clave)
+                return
+
+        #----------------------------------------------------------------------
+        # 6. Espera antes del siguiente intento
+        #----------------------------------------------------------------------
+        if intento < _MAX_REINTENTOS:
+            espera = _calcular_espera(intento, retry_after)
+            logger.info(f"🔁 Reintentando en {espera:.1f} s ({intento + 1}/{_MAX_REINTENTOS})...")
+            time.sleep(espera)
+
+    logger.error("❌ No se pudo enviar el mensaje a Telegram tras varios intentos")
+    if not entrega_incierta:
+        _liberar_envio(clave)
+
+
+#----------------------------------------------------------------------------
+# Envío agrupado de varias alertas
+#----------------------------------------------------------------------------
+
+def enviar_telegram_batch(alertas: list[str]) -> None:
+    """
+    Envía una lista de alertas agrupándolas en el menor número de mensajes
+    posible, en lugar de hacer una petición por alerta.
+
+    Las alertas se unen con saltos de línea y se dividen en bloques de como
+    máximo _MAX_CARACTERES caracteres (Telegram rechaza mensajes de más de
+    4096), cortando siempre entre alertas.
+
+    Parámetros:
+        alertas: list[str]
+            Mensajes de alerta a enviar.
+
+    Retorna:
+        None
+    """
+    for bloque in _agrupar_alertas(alertas, _MAX_CARACTERES):
+        enviar_telegram(bloque)
+
+
+def _agrupar_alertas(alertas, max_caracteres):
+    """
+    Agrupa las alertas en textos separados por saltos de línea de longitud
+    máxima max_caracteres. Una alerta más larga que el límite se trocea.
+    """
+    bloques = []
+    actual = ""
+    for alerta in alertas:
+        # Alerta que por sí sola supera el límite: se parte en trozos
+        while len(alerta) > max_caracteres:
+            if actual:
+                bloques.append(actual)
+                actual = ""
+            bloques.append(alerta[:max_caracteres])
+            alerta = alerta[max_caracteres:]
+
+        if not actual:
+            actual = alerta
+        elif len(actual) + 1 + len(alerta) <= max_caracteres:
+            actual = f"{actual}\n{alerta}"
+        else:
+            bloques.append(actual)
+            actual = alerta
+
+    if actual:
+        bloques.append(actual)
+    return bloques
+
+
+#----------------------------------------------------------------------------
+# Funciones auxiliares de reintento
+#----------------------------------------------------------------------------
+
+def _leer_retry_after(resp):
+    """
+    Devuelve los segundos de espera que indica Telegram, o None si no los
+    indica o no son un número.
+
+    Telegram los envía en el cuerpo JSON (parameters.retry_after); la
+    cabecera Retry-After se usa solo como respaldo.
+    """
+    try:
+        cuerpo = json.loads(resp.data)
+        valor = cuerpo.get("parameters", {}).get("retry_after")
+    except (ValueError, TypeError, AttributeError):
+        valor = None
+    if valor is None:
+        valor = resp.headers.get("Retry-After")
+    try:
+        return float(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _calcular_espera(intento, retry_after=None):
+    """
+    Calcula la espera antes de reintentar.
+
+    Si el servidor indicó Retry-After se respeta (con el mismo tope máximo).
+    Si no, se usa backoff exponencial (1 s, 2 s, 4 s...) con un jitter
+    aleatorio de hasta +50% para no reintentar todos a la vez.
+    """
+    if retry_after is not None:
+        return min(_ESPERA_MAXIMA, retry_after)
+    espera = min(_ESPERA_MAXIMA, _ESPERA_BASE * 2 ** intento)
+    return espera * (1 + random.uniform(0, 0.5))
+
+
+#----------------------------------------------------------------------------
+# Idempotencia de los envíos
+#----------------------------------------------------------------------------
+
+def _clave_idempotencia(mensaje, fecha):
+    """
+    Genera la clave de un mensaje: hash SHA-1 del texto más la fecha de
+    envío (hoy, YYYY-MM-DD). Un mismo texto enviado otro día genera una
+    clave distinta.
+    """
+    return hashlib.sha1(f"{mensaje}|{fecha}".encode("utf-8")).hexdigest()
+
+
+def _registrar_envio(clave, fecha):
+    """
+    Registra la clave en la tabla de alertas enviadas (db.database).
+
+    Retorna:
+        bool
+            True si la clave es nueva (hay que enviar), False si ya existía.
+            Si la base de datos no está disponible se devuelve True para no
+            bloquear el envío de alertas.
+    """
+    try:
+        return registrar_envio_alerta(clave, fecha)
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ No se pudo registrar el envío: {e}")
+        return True
+
+
+def _liberar_envio(clave):
+    """
+    Elimina la clave de un mensaje que no se llegó a enviar, para que una
+    ejecución posterior pueda volver a intentarlo.
+    """
+    try:
+        liberar_envio_alerta(clave)
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ No se pudo liberar la clave de envío: {e}")
@@ -13,11 +13,15 @@ Descripción:
     Se utiliza para validar rápidamente el pipeline de alertas.
 """
 
+import logging
+
 import pandas as pd
 
 from alerts.alert_rules import preparar_df_alertas, detectar_alertas
 from alerts.alert_sender import enviar_alertas
 
+logger = logging.getLogger(__name__)
+
 
 def check_alerts(df_pred):
     """
@@ -36,7 +40,7 @@ def check_alerts(df_pred):
         3. imprimir alertas encontradas
         4. Enviar alertas mediante alert_sender.
     """
-    print("\n=== CHECK ALERTS ===")
+    logger.info("=== CHECK ALERTS ===")
 
     # Preparación del dataFrame según reglas internas
     df = preparar_df_alertas(df_pred)
@@ -44,17 +48,17 @@ def check_alerts(df_pred):
     # Detección de alertas según umbrales definidos
     alertas = detectar_alertas(df)
 
-    print("\nAlertas detectadas:")
+    logger.info("Alertas detectadas:")
     if not alertas:
-        print(" - Ninguna alerta detectada")
+        logger.info(" - Ninguna alerta detectada")
     else:
         for a in alertas:
-            print(" -", a)
+            logger.info(" - %s", a)
 
     # Envíoi de alertas (Telegram, email)
     enviar_alertas(alertas)
 
-    print("\n=== FIN CHECK ALERTS ===")
+    logger.info("=== FIN CHECK ALERTS ===")
 
 
 #---------------------------------------------------------------
@@ -62,6 +66,9 @@ def check_alerts(df_pred):
 #---------------------------------------------------------------
 
 if __name__ == "__main__":
+    # Configuración única de logging para esta ejecución
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     # DataFrame de prueba para avlidar el sistema de alertas
     df_pred = pd.DataFrame({
         "time": pd.to_datetime([
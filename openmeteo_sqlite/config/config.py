@@ -38,6 +38,9 @@ DB_PATH = os.path.join(DATA_DIR, "openmeteo.db")
 # Nombre de la tabla principal
 TABLA_DB = "mediciones"
 
+# Carpeta de caché de respuestas de la API de Open-Meteo
+CACHE_DIR = os.path.join(DATA_DIR, "cache_api")
+
 #---------------------------------------------------------------------
 # VARIABLES DE ENTORNO
 #---------------------------------------------------------------------
@@ -10,7 +10,8 @@ Descripción:
     
 Funcionalidades clave:
     1. Integridad Temporal:
-        - Conversión robusta de la columna 'time' a datetime.
+        - Conversión de la columna 'time' a datetime en una sola pasada,
+          detectando el formato a partir del primer valor.
         - Eliminación de duplicados y ordenación cronológica.
     2. Gestión de Nulos: 
         - Eliminación de columnas completamente vacías.
@@ -32,82 +33,191 @@ Notas Técnicas
   las predicciones de la IA.
 """
 
+import re
+
 import pandas as pd
 import numpy as np
 
+# Formatos de fecha que devuelve Open-Meteo (diario y horario)
+_RE_FECHA_DIARIA = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_RE_FECHA_HORARIA = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}$")
+
+# Límites físicos (mínimo, máximo) de las variables que se validan.
+LIMITES_FISICOS = {
+    "relative_humidity_2m": (0, 100),
+    "wind_speed_10m": (0, np.inf),
+    "surface_pressure": (850, 1100),
+}
+
+#-----------------------------------------------------------------------------------
+# Detección del formato de fecha
+#-----------------------------------------------------------------------------------
+
+def _detectar_formato_fecha(serie):
+    """
+    Elige el formato de parseo de la columna 'time' a partir del primer valor
+    no nulo, para hacer una única llamada a pd.to_datetime con formato fijo.
+
+    Los formatos que emite Open-Meteo (diario y horario) se reconocen con una
+    expresión regular y se parsean con un formato exacto, que es el camino
+    más rápido de pandas.
+
+    Retorna:
+        str
+            - "%Y-%m-%d" para fechas diarias (YYYY-MM-DD).
+            - "%Y-%m-%dT%H:%M" para fechas horarias de Open-Meteo.
+            - "%Y-%m-%dT%H:%M:%SZ" si las fechas terminan en Z (UTC).
+            - "ISO8601" en cualquier otro caso.
+    """
+    no_nulos = serie.dropna()
+    muestra = str(no_nulos.iloc[0]) if len(no_nulos) else ""
+
+    if _RE_FECHA_DIARIA.match(muestra):
+        return "%Y-%m-%d"
+    if _RE_FECHA_HORARIA.match(muestra):
+        return "%Y-%m-%dT%H:%M"
+    if muestra.endswith("Z"):
+        return "%Y-%m-%dT%H:%M:%SZ"
+    return "ISO8601"
+
+#-----------------------------------------------------------------------------------
+# Interpolación de huecos
+#-----------------------------------------------------------------------------------
+
+def _interpolar_columnas(valores):
+    """
+    Rellena los NaN de cada columna de un array 2D con np.interp.
+
+    np.interp interpola linealmente entre los puntos válidos y, fuera de
+    ellos, repite el primer/último valor válido. Es el mismo resultado que
+    DataFrame.interpolate(limit_direction="both") (posiciones equiespaciadas),
+    pero en un bucle de C por columna en lugar de la maquinaria de pandas.
+
+    Parámetros:
+        valores: np.ndarray
+            Array float (filas x columnas). Se modifica in situ.
+
+    Retorna:
+        np.ndarray
+            El mismo array, sin NaN en las columnas que tienen algún valor válido.
+    """
+    posiciones = np.arange(valores.shape[0])
+    for j in range(valores.shape[1]):
+        columna = valores[:, j]
+        nulos = np.isnan(columna)
+        # Columna sin ningún valor válido: no hay con qué interpolar
+        if nulos.all():
+            continue
+        columna[nulos] = np.interp(posiciones[nulos], posiciones[~nulos], columna[~nulos])
+    return valores
+
 #-----------------------------------------------------------------------------------
 # Función principal de limpieza
 #-----------------------------------------------------------------------------------
 
-def clean_df(df):
+def clean_df(df, *, float32=False):
     """
     Realiza una limpieza robusta sobre un DataFrame meteorológico.
     
     Parámetros:
         df: pd.dataFrame
             datos brutos obtenidos de la API de OpenMeteo.
+        float32: bool, opcional
+            Si es True, convierte las columnas float64 a float32 al final,
+            reduciendo a la mitad la memoria del DataFrame. Pensado para uso
+            en memoria; no debe activarse antes de guardar en SQLite, donde
+            los valores se almacenarían con decimales espurios (12.3 -> 12.30000019).
+            Por defecto False.
     
     Retorna:
         pd.DataFrame
             DataFrame limpio, consistenete y lkisto para la generación de features.
     """
-    # Se trabaja sobre una copia para no modificar el DataFrame original.
-    df = df.copy()
-
     #---------------------------------------------------------------------------
     # 1. Eliminar columnas completamente vacías
     #---------------------------------------------------------------------------
-    cols_vacias = df.columns[df.isna().all()]
-    if len(cols_vacias) > 0:
-        df = df.drop(columns=cols_vacias)
+    # dropna() devuelve un DataFrame nuevo, así que el original no se modifica
+    # en los pasos siguientes y no hace falta una copia explícita previa.
+    df = df.dropna(axis=1, how="all")
+
+    # Nombres de columna como conjunto, calculado una sola vez: las columnas
+    # ya no cambian y las comprobaciones de pertenencia son O(1).
+    cols = frozenset(df.columns)
 
     #---------------------------------------------------------------------------
     # # 2. NORMALIZACIÓN DE TIPOS NUMÉRICOS
     #---------------------------------------------------------------------------
-    for col in df.columns:
-        if col != "time": 
-            df[col] = pd.to_numeric(df[col], errors="coerce")
+    # Solo se convierten las columnas que no son ya numéricas (texto/objeto).
+    # Las numéricas se dejan intactas: convertirlas no cambia nada y obliga
+    # a reconstruir el DataFrame columna a columna.
+    cols_texto = [
+        col for col in df.columns
+        if col != "time" and not pd.api.types.is_numeric_dtype(df[col])
+    ]
+    if cols_texto:
+        df[cols_texto] = df[cols_texto].apply(pd.to_numeric, errors="coerce")
 
     #---------------------------------------------------------------------------
     # 3. TRATAMIENTO CRÍTICO DE FECHAS
     #---------------------------------------------------------------------------
-    if "time" in df.columns:
-        # Intento 1: Formato ISO estándar
-        df["time"] = pd.to_datetime(df["time"], errors="coerce")
-
-        # Intento 2: Formato Open-Meteo (T entre fecha y hora)
-        if df["time"].isna().mean() > 0.5:
-            df["time"] = pd.to_datetime(df["time"], format="%Y-%m-%dT%H:%M", errors="coerce")
+    if "time" in cols:
+        # Se parsea una sola vez. Si la columna ya es datetime no se toca;
+        # si es texto, se detecta el formato a partir del primer valor.
+        if not pd.api.types.is_datetime64_any_dtype(df["time"]):
+            df["time"] = pd.to_datetime(
+                df["time"], format=_detectar_formato_fecha(df["time"]),
+                errors="coerce", cache=True,
+            )
 
-        # Intento 3: Formato con zona horaria Z
-        if df["time"].isna().mean() > 0.5:
-            df["time"] = pd.to_datetime(df["time"], format="%Y-%m-%dT%H:%M:%SZ", errors="coerce")
-
-        # Eliminar filas que no tengan fecha válida tras los intentos
+        # Eliminar filas que no tengan fecha válida
         df = df.dropna(subset=["time"])
         
-        # Ordenar cronológicamente y eliminar duplicados
-        df = df.sort_values("time")
-        df = df.drop_duplicates(subset=["time"])
+        # Ordenar cronológicamente y eliminar duplicados en un solo paso:
+        # np.unique ordena las fechas y devuelve la primera aparición de cada
+        # una, así que basta una única selección de filas con iloc.
+        fechas = df["time"].to_numpy(dtype="datetime64[ns]")
+        _, idx_unicos = np.unique(fechas, return_index=True)
+        df = df.iloc[idx_unicos]
 
     #---------------------------------------------------------------------------
     # 4. VALIDACIÓN DE LÍMITES FÍSICOS
     # Evitamos que ruidos en los sensores generen datos meteorológicamente imposibles.
     #---------------------------------------------------------------------------
-    if "relative_humidity_2m" in df:
-        df["relative_humidity_2m"] = df["relative_humidity_2m"].clip(0, 100)
-
-    if "wind_speed_10m" in df:
-        df["wind_speed_10m"] = df["wind_speed_10m"].clip(lower=0)
-    
-    if "surface_pressure" in df:
-        df["surface_pressure"] = df["surface_pressure"].clip(850, 1100)
+    # Se recortan todas las columnas con límites en una única llamada a
+    # np.clip() sobre el array 2D, sin la gestión de nulos de DataFrame.clip()
+    # (np.clip ya deja los NaN como NaN para la imputación posterior).
+    # El recorte se hace in situ (out=) sobre la copia que devuelve to_numpy,
+    # sin reservar un segundo array para el resultado.
+    cols_limitadas = [col for col in LIMITES_FISICOS if col in cols]
+    if cols_limitadas:
+        inferiores = np.array([LIMITES_FISICOS[col][0] for col in cols_limitadas], dtype=float)
+        superiores = np.array([LIMITES_FISICOS[col][1] for col in cols_limitadas], dtype=float)
+        valores = df[cols_limitadas].to_numpy(dtype=float, copy=True)
+        np.clip(valores, inferiores, superiores, out=valores)
+        df[cols_limitadas] = valores
 
     #---------------------------------------------------------------------------
     # 5. IMPUTACIÓN INTELIGENTE DE DATOS FALTANTES
     # Solo interpolamos si estamos entrenando o para variables de apoyo (viento/presión).
     #---------------------------------------------------------------------------
-    num_cols = df.select_dtypes(include=["number"]).columns
-    df[num_cols] = df[num_cols].interpolate().ffill().bfill()
+    # Solo se procesan las columnas numéricas que realmente tienen huecos.
+    # Los huecos interiores se interpolan linealmente y los extremos se rellenan
+    # con el valor válido más cercano, equivalente a interpolate().ffill().bfill().
+    # Las columnas numéricas se obtienen en una sola pasada por df.dtypes
+    # (enteros, sin signo y flotantes) y se reutilizan en el paso 6.
+    tipos = df.dtypes
+    num_cols = tipos.index[[t.kind in "fiu" for t in tipos]]
+    cols_con_nulos = num_cols[df[num_cols].isna().any().to_numpy()]
+    if len(cols_con_nulos) > 0:
+        valores = df[cols_con_nulos].to_numpy(dtype=float, na_value=np.nan, copy=True)
+        df[cols_con_nulos] = _interpolar_columnas(valores)
+
+    #---------------------------------------------------------------------------
+    # 6. REDUCCIÓN DE PRECISIÓN (OPCIONAL)
+    #---------------------------------------------------------------------------
+    if float32:
+        cols_float = [col for col in num_cols if df[col].dtype == np.float64]
+        if len(cols_float) > 0:
+            df[cols_float] = df[cols_float].astype("float32")
 
     return df
\ No newline at end of file
@@ -15,11 +15,20 @@ Funcionalidades:
         Convierte datos horarios en medias diaroas para mantener consistencia con la 
         tabla de mediciones del sistema.
     3. Resiliencia: 
-        Implementa un sistema de reintentos (hasta 5) con pausas estratégicas ante 
-        fallos de conexión o límites de tasa (Rate Limit).
+        Implementa un sistema de reintentos (hasta 5) con backoff exponencial ante 
+        fallos de conexión, errores 5xx o límites de tasa (429, respetando Retry-After).
     4. Mezcla de Datos (Merge): 
         Combina variables diarias (temperaturas mín/máx)con variables horarias 
         promediadas (humedad, presión, viento, nubosidad).
+    5. Caché de respuestas:
+        Guarda en disco cada respuesta válida de la API (datos/cache_api). Las
+        del archivo histórico no cambian y se reutilizan durante 30 días; las
+        de forecast, durante 1 hora. Así las re-ejecuciones no tocan la red.
+    6. Descarga concurrente:
+        Permite descargar varias ubicaciones a la vez en hilos, de modo que el
+        tiempo total es el de la petición más lenta y no la suma de todas.
+        Los rangos históricos largos se dividen además en tramos anuales que
+        también se descargan en paralelo.
 
 FLUJO DE DATOS:
     Input:
@@ -31,11 +40,74 @@ FLUJO DE DATOS:
         DataFrame unificado y listo para el proceso de limpieza (cleaning.py).
 """
 
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
 import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import date
-from config.config import START_DATE, END_DATE
+from config.config import START_DATE, END_DATE, CACHE_DIR
+
+# Parser JSON: orjson si está instalado (bastante más rápido con respuestas
+# grandes llenas de floats); si no, el módulo json estándar. Ambos aceptan bytes.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Logger del módulo. Los handlers se configuran en el punto de entrada
+# (main.py, ingest.py), no aquí.
+logger = logging.getLogger(__name__)
+
+#---------------------------------------------------------------------------------
+# Endpoints y variables solicitadas (constantes: se construyen una sola vez)
+#---------------------------------------------------------------------------------
+URL_FORECAST = "https://api.open-meteo.com/v1/forecast"
+URL_ARCHIVO = "https://archive-api.open-meteo.com/v1/archive"
+
+# Variables diarias que se piden directamente a la API
+VARIABLES_DIARIAS = [
+    "temperature_2m_mean", "temperature_2m_max", "temperature_2m_min",
+    "apparent_temperature_mean", "shortwave_radiation_sum", "precipitation_sum",
+    "sunshine_duration", "daylight_duration", "wind_direction_10m_dominant",
+]
+
+# Variables horarias que se promedian para obtener un valor diario
+VARIABLES_HORARIAS = ["relative_humidity_2m", "surface_pressure", "wind_speed_10m", "cloud_cover"]
+
+# Parte fija de la query string, común a ambos endpoints
+_QUERY_VARIABLES = (
+    f"&daily={','.join(VARIABLES_DIARIAS)}"
+    f"&hourly={','.join(VARIABLES_HORARIAS)}"
+    "&timezone=auto"
+)
+
+# Sesión HTTP compartida por todas las descargas: reutiliza las conexiones
+# TCP+TLS (keep-alive) con los dos hosts de Open-Meteo en lugar de abrir una
+# nueva en cada petición. El pool admite tantas conexiones por host como
+# descargas simultáneas lanza descargar_datos_openmeteo_batch().
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+# Política de reintentos
+_MAX_INTENTOS = 5
+_ESPERA_BASE = 1.0       # segundos
+_ESPERA_MAXIMA = 60.0    # segundos
+_ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+# Vigencia de la caché de respuestas (segundos)
+CACHE_TTL_ARCHIVO = 30 * 24 * 3600   # datos históricos: no cambian
+CACHE_TTL_FORECAST = 3600            # previsión: se actualiza cada hora
 
 #---------------------------------------------------------------------------------
 # Función principal: descarga y unificación de datos
@@ -69,84 +141,367 @@ def descargar_datos_openmeteo(lat, lon, fecha_ini=None, fecha_fin=None):
     # ---------------------------------------------------------------------------
     # Si la fecha final es hoy o futura, usamos el endpoint de Forecast.
     if fecha_fin_str >= hoy_str:
-        print(f"📡 Usando API de Forecast para {fecha_fin_str}...")
-        url = (
-            f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}"
-            "&daily=temperature_2m_mean,temperature_2m_max,temperature_2m_min,"
-            "apparent_temperature_mean,shortwave_radiation_sum,precipitation_sum,"
-            "sunshine_duration,daylight_duration,wind_direction_10m_dominant"
-            "&hourly=relative_humidity_2m,surface_pressure,wind_speed_10m,cloud_cover"
-            "&timezone=auto&past_days=31"
-        )
+        logger.info(f"📡 Usando API de Forecast para {fecha_fin_str}...")
+        ttl_cache = CACHE_TTL_FORECAST
+        url = f"{URL_FORECAST}?latitude={lat}&longitude={lon}{_QUERY_VARIABLES}&past_days=31"
     else:
         # Para datos puramente históricos, usamos el endpoint de Archive.
-        print(f"📚 Usando API de Archivo Histórico para el rango {fecha_ini_str} a {fecha_fin_str}...")
+        logger.info(f"📚 Usando API de Archivo Histórico para el rango {fecha_ini_str} a {fecha_fin_str}...")
+        ttl_cache = CACHE_TTL_ARCHIVO
         url = (
-            f"https://archive-api.open-meteo.com/v1/archive?latitude={lat}&longitude={lon}"
-            f"&start_date={fecha_ini_str}&end_date={fecha_fin_str}"
-            "&daily=temperature_2m_mean,temperature_2m_max,temperature_2m_min,"
-            "apparent_temperature_mean,shortwave_radiation_sum,precipitation_sum,"
-            "sunshine_duration,daylight_duration,wind_direction_10m_dominant"
-            "&hourly=relative_humidity_2m,surface_pressure,wind_speed_10m,cloud_cover"
-            "&timezone=auto"
+            f"{URL_ARCHIVO}?latitude={lat}&longitude={lon}"
+            f"&start_date={fecha_ini_str}&end_date={fecha_fin_str}{_QUERY_VARIABLES}"
         )
 
     # ---------------------------------------------------------------------------
     # 2. GESTIÓN DE PETICIONES Y REINTENTOS
     # ---------------------------------------------------------------------------
-    for intento in range(5):
+    for intento in range(_MAX_INTENTOS):
+        retry_after = None
         try:
-            r = requests.get(url, timeout=60) 
-            data = r.json()
+            # Si hay una respuesta vigente en caché, no se hace la petición
+            data = _leer_cache(url, ttl_cache)
+            if data is None:
+                r = _SESSION.get(url, timeout=60) 
+
+                # Límite de tasa o error temporal del servidor: se reintenta
+                # tras la espera que indique la API (Retry-After) o con backoff.
+                if r.status_code in _ESTADOS_REINTENTABLES:
+                    logger.warning(f"⚠️ Intento {intento+1}: la API respondió {r.status_code}")
+                    retry_after = _leer_retry_after(r)
+                    if intento < _MAX_INTENTOS - 1:
+                        time.sleep(_calcular_espera(intento, retry_after))
+                    continue
+
+                # Se parsean los bytes directamente, sin que requests tenga
+                # que detectar la codificación y decodificar a texto.
+                data = _json_loads(r.content)
+                if "daily" in data and "hourly" in data:
+                    _guardar_cache(url, data)
+            else:
+                logger.info("🗄️ Respuesta recuperada de la caché local")
 
             # Validación mínima: deben existir bloques daily y hourly
             if "daily" in data and "hourly" in data:
                 # Procesamiento de Datos Diarios
-                df_daily = pd.DataFrame(data["daily"])
-                df_daily["time"] = pd.to_datetime(df_daily["time"])
+                df_daily = _bloque_a_dataframe(data["daily"], "%Y-%m-%d")
 
                 # Procesamiento de Datos Horarios (Agregación)
-                df_hourly = pd.DataFrame(data["hourly"])
-                df_hourly["time"] = pd.to_datetime(df_hourly["time"])
-                df_hourly["date_tmp"] = df_hourly["time"].dt.date
-                
+                df_hourly = _bloque_a_dataframe(data["hourly"], "%Y-%m-%dT%H:%M")
+
                 # Agregamos los datos horarios para obtener una media diaria única
-                df_hourly_agg = df_hourly.groupby("date_tmp").agg({
-                    "relative_humidity_2m": "mean",
-                    "surface_pressure": "mean",
-                    "wind_speed_10m": "mean",
-                    "cloud_cover": "mean"
-                }).reset_index()
-                
-                # Sincronizamos nombres de columna para el cruce (Merge)
-                df_hourly_agg.rename(columns={"date_tmp": "time"}, inplace=True)
-                df_hourly_agg["time"] = pd.to_datetime(df_hourly_agg["time"])
+                df_hourly_agg = _agregar_horario_a_diario(df_hourly)
 
                 # Unión de tablas: Daily + Hourly_Aggregated
-                df_res = pd.merge(df_daily, df_hourly_agg, on="time", how="left")
+                # Lo habitual es que ambas tablas cubran exactamente los mismos
+                # días en el mismo orden: entonces las columnas se añaden por
+                # posición, sin el hash-join de merge. Si no, se cruzan por 'time'.
+                if np.array_equal(df_daily["time"].to_numpy(), df_hourly_agg["time"].to_numpy()):
+                    df_res = df_daily.assign(**{
+                        col: df_hourly_agg[col].to_numpy() for col in VARIABLES_HORARIAS
+                    })
+                else:
+                    df_res = pd.merge(df_daily, df_hourly_agg, on="time", how="left")
                 
                 # -----------------------------------------------------------------------
                 # 3. FILTRADO FINAL POR MÁSCARA TEMPORAL
                 # -----------------------------------------------------------------------
-                df_res['time_only'] = df_res['time'].dt.date
-                f_ini_dt = pd.to_datetime(fecha_ini_str).date()
-                f_fin_dt = pd.to_datetime(fecha_fin_str).date()
-                
-                mask = (df_res['time_only'] >= f_ini_dt) & (df_res['time_only'] <= f_fin_dt)
-                
+                # Se compara directamente el array datetime64 con los límites del
+                # rango [inicio, fin + 1 día), sin crear objetos date por fila.
+                tiempos = df_res['time'].to_numpy()
+                f_ini_dt = np.datetime64(pd.Timestamp(fecha_ini_str).normalize())
+                f_fin_dt = np.datetime64(pd.Timestamp(fecha_fin_str).normalize() + pd.Timedelta(days=1))
+
+                mask = tiempos >= f_ini_dt
+
                 # Si es forecast, devolvemos desde la fecha de inicio hasta el final de la serie
                 if fecha_fin_str >= hoy_str:
-                    return df_res[df_res['time_only'] >= f_ini_dt].drop(columns=['time_only'])
-                
-                return df_res.loc[mask].drop(columns=['time_only'])
+                    return df_res[mask]
+
+                mask &= tiempos < f_fin_dt
+                return df_res[mask]
 
             # Si la API devuelve un error explícito
             if "error" in data:
-                print(f"❌ Error API: {data.get('reason', 'Desconocido')}")
+                logger.error(f"❌ Error API: {data.get('reason', 'Desconocido')}")
                 break
 
         except Exception as e:
-            print(f"⚠️ Intento {intento+1} fallido: {e}")
-            time.sleep(5) # Pausa de seguridad antes de reintentar
+            logger.warning(f"⚠️ Intento {intento+1} fallido: {e}")
+            # Pausa creciente antes de reintentar (1 s, 2 s, 4 s...)
+            if intento < _MAX_INTENTOS - 1:
+                time.sleep(_calcular_espera(intento))
+
+    return pd.DataFrame()
+
+
+#---------------------------------------------------------------------------------
+# Conversión de la respuesta JSON a DataFrame
+#---------------------------------------------------------------------------------
+
+def _bloque_a_dataframe(bloque, formato_fecha):
+    """
+    Convierte un bloque 'daily' u 'hourly' de la respuesta (dict de listas)
+    en un DataFrame con 'time' como datetime64 y el resto en float64.
+
+    Cada lista se convierte a un array float64 en una sola pasada de NumPy
+    (los None pasan a NaN), sin que pandas tenga que inferir el tipo valor a
+    valor. Open-Meteo devuelve fechas ISO exactas: con el formato explícito
+    pandas usa su parser vectorizado, sin inferencia.
+    """
+    columnas = {"time": pd.to_datetime(bloque["time"], format=formato_fecha)}
+    for nombre, valores in bloque.items():
+        if nombre != "time":
+            columnas[nombre] = np.asarray(valores, dtype=np.float64)
+    return pd.DataFrame(columnas)
+
+
+#---------------------------------------------------------------------------------
+# Funciones auxiliares de reintento
+#---------------------------------------------------------------------------------
+
+def _leer_retry_after(resp):
+    """
+    Devuelve los segundos indicados en la cabecera Retry-After, o None si
+    no existe o no es un número.
+    """
+    valor = resp.headers.get("Retry-After")
+    try:
+        return float(valor) if valor is not None else None
+    except ValueError:
+        return None
+
+
+def _calcular_espera(intento, retry_after=None):
+    """
+    Calcula la espera antes de reintentar: Retry-After si la API lo indicó,
+    o backoff exponencial con jitter de hasta +50%, siempre con un tope.
+    """
+    if retry_after is not None:
+        return min(_ESPERA_MAXIMA, retry_after)
+    espera = min(_ESPERA_MAXIMA, _ESPERA_BASE * 2 ** intento)
+    return espera * (1 + random.uniform(0, 0.5))
+
+
+#---------------------------------------------------------------------------------
+# Caché de respuestas en disco
+#---------------------------------------------------------------------------------
+
+def _ruta_cache(url):
+    """Ruta del archivo de caché de una URL (hash SHA-1 de la URL)."""
+    clave = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{clave}.json")
+
+
+def _leer_cache(url, ttl):
+    """
+    Devuelve la respuesta JSON guardada para la URL si existe y tiene menos
+    de 'ttl' segundos; en otro caso None.
+    """
+    ruta = _ruta_cache(url)
+    try:
+        if time.time() - os.path.getmtime(ruta) > ttl:
+            return None
+        with open(ruta, "rb") as f:
+            return _json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _guardar_cache(url, data):
+    """
+    Guarda la respuesta JSON de la URL. Se escribe en un archivo temporal y
+    se renombra, para que una lectura concurrente nunca vea un archivo a medias.
+    Los errores de escritura se ignoran: la caché es solo una optimización.
+    """
+    ruta = _ruta_cache(url)
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, ruta)
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudo guardar la respuesta en caché: {e}")
+
+
+#---------------------------------------------------------------------------------
+# Agregación horaria -> diaria
+#---------------------------------------------------------------------------------
+
+
+def _agregar_horario_a_diario(df_hourly):
+    """
+    Calcula la media diaria de las variables horarias.
+
+    Open-Meteo devuelve 24 registros consecutivos por día, empezando a las
+    00:00. En ese caso cada columna se reorganiza como una matriz (días x 24)
+    y se promedia por filas con NumPy, sin pasar por groupby. Si la serie no
+    cumple esa estructura (días incompletos, huecos), se usa groupby por día.
+
+    Parámetros:
+        df_hourly: pd.DataFrame
+            Datos horarios con 'time' ya convertido a datetime.
+
+    Retorna:
+        pd.DataFrame
+            Una fila por día con 'time' (a medianoche) y la media de cada
+            variable horaria. Los NaN se ignoran, igual que en groupby().mean().
+    """
+    n = len(df_hourly)
+    horas = df_hourly["time"].dt.hour.to_numpy()
+
+    if n > 0 and n % 24 == 0 and (horas.reshape(-1, 24) == np.arange(24)).all():
+        n_dias = n // 24
+        agregado = {"time": df_hourly["time"].iloc[::24].reset_index(drop=True)}
+        with warnings.catch_warnings():
+            # Un día sin ningún dato devuelve NaN (como groupby) sin avisar
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            for col in VARIABLES_HORARIAS:
+                valores = df_hourly[col].to_numpy(dtype=float).reshape(n_dias, 24)
+                agregado[col] = np.nanmean(valores, axis=1)
+        return pd.DataFrame(agregado)
+
+    # Caso general: agrupación por día natural. La clave es el número de día
+    # (int64 desde 1970-01-01), así groupby usa su camino rápido de enteros.
+    dias = df_hourly["time"].to_numpy().astype("datetime64[D]").view("i8")
+    agregado = df_hourly.groupby(dias)[VARIABLES_HORARIAS].mean()
+    agregado.insert(0, "time", pd.to_datetime(agregado.index.to_numpy(), unit="D"))
+    return agregado.reset_index(drop=True)
+
+
+#---------------------------------------------------------------------------------
+# Descarga concurrente de varias ubicaciones
+#---------------------------------------------------------------------------------
+
+def descargar_datos_openmeteo_batch(ubicaciones, fecha_ini=None, fecha_fin=None, max_workers=4):
+    """
+    Descarga en paralelo los datos de varias ubicaciones para el mismo rango.
+
+    La descarga es E/S de red bloqueante, así que cada ubicación se pide en un
+    hilo: el tiempo total pasa a ser el de la respuesta más lenta en lugar de
+    la suma de todas. max_workers limita las peticiones simultáneas para no
+    superar el límite de tasa de la API gratuita.
+
+    Parámetros:
+        ubicaciones: list[tuple[float, float]]
+            Pares (lat, lon) a descargar.
+        fecha_ini: str, opcional
+            Fecha de inicio YYYY-MM-DD.
+        fecha_fin: str, opcional
+            Fecha de fin YYYY-MM-DD.
+        max_workers: int
+            Número máximo de descargas simultáneas. Por defecto 4.
+
+    Retorna:
+        list[pd.DataFrame]
+            Un DataFrame por ubicación, en el mismo orden de entrada
+            (vacío si la descarga de esa ubicación falla).
+    """
+    resultados = [None] * len(ubicaciones)
+    for indice, df in descargar_datos_openmeteo_a_medida(ubicaciones, fecha_ini, fecha_fin, max_workers):
+        resultados[indice] = df
+    return resultados
+
+
+def descargar_datos_openmeteo_a_medida(ubicaciones, fecha_ini=None, fecha_fin=None, max_workers=4):
+    """
+    Igual que descargar_datos_openmeteo_batch(), pero entrega cada resultado
+    en cuanto termina su descarga, en orden de llegada.
+
+    Permite limpiar e insertar una ubicación mientras las demás siguen
+    descargándose, en lugar de esperar a que terminen todas.
+
+    Parámetros:
+        Los mismos que descargar_datos_openmeteo_batch().
+
+    Retorna:
+        Iterator[tuple[int, pd.DataFrame]]
+            Pares (índice en 'ubicaciones', DataFrame descargado).
+    """
+    if not ubicaciones:
+        return
+
+    # Los hilos libres se reparten entre los tramos anuales de cada ubicación,
+    # de modo que el total de peticiones simultáneas sigue rondando max_workers
+    # (con una sola ciudad, sus años se descargan en paralelo).
+    hilos_ubicaciones = min(max_workers, len(ubicaciones))
+    hilos_tramos = max(1, max_workers // hilos_ubicaciones)
 
-    return pd.DataFrame()
\ No newline at end of file
+    def _descargar(ubicacion):
+        lat, lon = ubicacion
+        return descargar_datos_openmeteo_por_tramos(lat, lon, fecha_ini, fecha_fin, hilos_tramos)
+
+    with ThreadPoolExecutor(max_workers=hilos_ubicaciones) as executor:
+        futuros = {executor.submit(_descargar, u): i for i, u in enumerate(ubicaciones)}
+        for futuro in as_completed(futuros):
+            yield futuros[futuro], futuro.result()
+
+
+#---------------------------------------------------------------------------------
+# Descarga de rangos largos por tramos anuales
+#---------------------------------------------------------------------------------
+
+def descargar_datos_openmeteo_por_tramos(lat, lon, fecha_ini=None, fecha_fin=None, max_workers=4):
+    """
+    Descarga un rango histórico largo dividido en tramos anuales paralelos.
+
+    Un rango 2000 -> hoy es una única respuesta JSON de varios MB. Partido en
+    años, cada petición es pequeña, se descarga y parsea en paralelo con las
+    demás, y los años completos tienen siempre la misma URL, así que quedan
+    en la caché local aunque cambie la fecha de fin del rango.
+
+    Los rangos de forecast o que caben en un solo año se piden de una vez
+    con descargar_datos_openmeteo().
+
+    Parámetros:
+        lat: float
+            Latitud de la ubicación.
+        lon: float
+            Longitud de la ubicación.
+        fecha_ini: str, opcional
+            Fecha de inicio YYYY-MM-DD.
+        fecha_fin: str, opcional
+            Fecha de fin YYYY-MM-DD.
+        max_workers: int
+            Número máximo de tramos descargados a la vez. Por defecto 4.
+
+    Retorna:
+        pd.DataFrame
+            DataFrame con todos los tramos en orden cronológico. Si falla la
+            descarga de algún tramo, retorna un DataFrame vacío (un año
+            ausente no debe rellenarse por interpolación).
+    """
+    fecha_ini_str = str(fecha_ini or START_DATE)
+    fecha_fin_str = str(fecha_fin or END_DATE)
+
+    tramos = _tramos_anuales(fecha_ini_str, fecha_fin_str)
+    if fecha_fin_str >= str(date.today()) or len(tramos) == 1:
+        return descargar_datos_openmeteo(lat, lon, fecha_ini_str, fecha_fin_str)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tramos))) as executor:
+        dfs = list(executor.map(lambda tramo: descargar_datos_openmeteo(lat, lon, *tramo), tramos))
+
+    if any(df.empty for df in dfs):
+        logger.error(f"❌ Falló la descarga de algún tramo anual ({fecha_ini_str} a {fecha_fin_str}).")
+        return pd.DataFrame()
+
+    # Los tramos son consecutivos y no se solapan: basta concatenarlos en orden
+    return pd.concat(dfs, ignore_index=True)
+
+
+def _tramos_anuales(fecha_ini_str, fecha_fin_str):
+    """
+    Divide [fecha_ini, fecha_fin] en tramos que no cruzan de un año a otro.
+
+    Retorna:
+        list[tuple[str, str]]
+            Pares (inicio, fin) en formato YYYY-MM-DD, en orden cronológico.
+    """
+    anio_ini, anio_fin = int(fecha_ini_str[:4]), int(fecha_fin_str[:4])
+    tramos = []
+    for anio in range(anio_ini, anio_fin + 1):
+        inicio = fecha_ini_str if anio == anio_ini else f"{anio}-01-01"
+        fin = fecha_fin_str if anio == anio_fin else f"{anio}-12-31"
+        tramos.append((inicio, fin))
+    return tramos
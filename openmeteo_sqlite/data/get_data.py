@@ -11,8 +11,9 @@ Funcionalidades:
     1. Orquestación Secuencial:
         Gestiona el flujo completo desde la API hasta SQLite.
     2. Normalización ISO:
-        Convierte todas las fechas a formato YYYY-MM-DD para evitar problemas
-        con SQLite y garantizar consistencia.
+        Las fechas se guardan en formato YYYY-MM-DD para evitar problemas
+        con SQLite y garantizar consistencia (la conversión se hace una sola
+        vez, al insertar).
     3. Gestión de Persistencia: 
         Permite elegir entre sobrescribir el histórico completo o añadir nuevos registros
         en modo incremental/forecast.
@@ -23,16 +24,21 @@ Flujo de trabajoO:
     API -> Downloader -> Cleaning -> SQLite Persistence.
 """
 
+import logging
 from datetime import datetime, date
 import pandas as pd
-from data.downloader import descargar_datos_openmeteo
+from data.downloader import descargar_datos_openmeteo_por_tramos
 from data.cleaning import clean_df
-from db.database import insertar_en_db, borrar_ciudad
+from db.database import insertar_en_db
+
+# Logger del módulo. Los handlers se configuran en el punto de entrada
+# (main.py, ingest.py), no aquí.
+logger = logging.getLogger(__name__)
 
 #----------------------------------------------------------------------------------------------
 # Función principal
 #----------------------------------------------------------------------------------------------
-def get_data(ciudad, lat, lon, fecha_ini=None, fecha_fin=None, modo_append=False):
+def get_data(ciudad, lat, lon, fecha_ini=None, fecha_fin=None, modo_append=False, df_bruto=None):
     """
     Coordina la descarga, limpieza y persistencia de datos meteorológicos.
 
@@ -50,6 +56,9 @@ def get_data(ciudad, lat, lon, fecha_ini=None, fecha_fin=None, modo_append=False
         modo_append: bool: 
             Si es True, conserva datos previos y añade nuevos registros.
             Si es false, borra el histórico de esa ciudad antes de insertar.
+        df_bruto: pd.DataFrame, opcional
+            Datos ya descargados (p. ej. con descargar_datos_openmeteo_batch).
+            Si se indica, se omite la llamada a la API.
     
         Retorna:
             pd.DataFrame or None
@@ -63,20 +72,24 @@ def get_data(ciudad, lat, lon, fecha_ini=None, fecha_fin=None, modo_append=False
     f_ini = pd.to_datetime(fecha_ini).strftime('%Y-%m-%d')
     f_fin = pd.to_datetime(fecha_fin).strftime('%Y-%m-%d')
 
-    print(f"\n📡 --- INICIANDO PROCESO PARA: {ciudad} ---")
-    print(f"📅 Rango solicitado: {f_ini} al {f_fin}")
+    logger.info(f"📡 --- INICIANDO PROCESO PARA: {ciudad} ---")
+    logger.info(f"📅 Rango solicitado: {f_ini} al {f_fin}")
 
     # ---------------------------------------------------------------------------
     # 2. FASE DE ADQUISICIÓN (API CALL)
     # ---------------------------------------------------------------------------
-    df = descargar_datos_openmeteo(lat, lon, f_ini, f_fin)
+    if df_bruto is None:
+        # Los rangos largos se piden por años en paralelo (ver downloader.py)
+        df = descargar_datos_openmeteo_por_tramos(lat, lon, f_ini, f_fin)
+    else:
+        df = df_bruto
 
     # Verificación de respuesta
     if df is None or df.empty:
-        print(f"❌ La API no devolvió datos para {ciudad} en este rango.")
+        logger.error(f"❌ La API no devolvió datos para {ciudad} en este rango.")
         return None
     
-    print(f"📊 Datos brutos recibidos: {len(df)} registros.")
+    logger.info(f"📊 Datos brutos recibidos: {len(df)} registros.")
 
     # ---------------------------------------------------------------------------
     # 3. FASE DE SANEAMIENTO (CLEANING)
@@ -85,27 +98,28 @@ def get_data(ciudad, lat, lon, fecha_ini=None, fecha_fin=None, modo_append=False
     df = clean_df(df)
     
     if df.empty:
-        print(f"⚠ El proceso de limpieza eliminó todos los registros. Revisa cleaning.py")
+        logger.warning(f"⚠ El proceso de limpieza eliminó todos los registros. Revisa cleaning.py")
         return None
 
     # ---------------------------------------------------------------------------
     # 4. PREPARACIÓN PARA SQLITE 
     # ---------------------------------------------------------------------------
-    # SQLite no tiene tipo 'Date'. Convertimos el objeto Timestamp a String ISO.
-    df['time'] = pd.to_datetime(df['time']).dt.strftime('%Y-%m-%d')
+    # SQLite no tiene tipo 'Date'. 'time' se deja como datetime64 (garantizado
+    # por clean_df): insertar_en_db lo convierte a String ISO directamente,
+    # sin un paso intermedio de texto que luego habría que volver a parsear.
     df["estacion"] = ciudad
 
     # ---------------------------------------------------------------------------
     # 5. GESTIÓN DE PERSISTENCIA EN BASE DE DATOS
     # ---------------------------------------------------------------------------
-    # Si modo_append=False (Carga Histórica), limpiamos el histórico de esa ciudad.
+    # Si modo_append=False (Carga Histórica), se reemplaza el histórico de esa
+    # ciudad: el borrado y la inserción se hacen en una única transacción.
     if not modo_append:
-        print(f"🧹 Limpiando registros antiguos de {ciudad}...")
-        borrar_ciudad(ciudad)
+        logger.info(f"🧹 Limpiando registros antiguos de {ciudad}...")
     
     # Inserción de los nuevos registros procesados
-    insertar_en_db(df, ciudad)
+    insertar_en_db(df, ciudad, reemplazar=not modo_append)
     
     # Resumen de finalización
-    print(f"✅ Finalizado: {len(df)} registros procesados (Desde {df['time'].min()} hasta {df['time'].max()})")
+    logger.info(f"✅ Finalizado: {len(df)} registros procesados (Desde {df['time'].min():%Y-%m-%d} hasta {df['time'].max():%Y-%m-%d})")
     return df
\ No newline at end of file
@@ -9,9 +9,12 @@ Descripción:
 
 Estrategia de carga:
     1. Fase Histórica (Bloque 1):
-        Descarga masiva desde el año 2000 hasta ayer.
-        Utiliza 'modo_append=False' para limpiar la base de datos y evitar 
-        duplicados antiguos.
+        Sincronización incremental: para cada ciudad solo se descargan los días
+        posteriores al último guardado (con un margen de solape) hasta ayer,
+        y se añaden con UPSERT ('modo_append=True'). Si la ciudad no tiene
+        datos, se descarga desde el año 2000.
+        Con reconstruir=True (--reconstruir) se recarga todo el histórico
+        desde 2000 con 'modo_append=False', reemplazando el existente.
     2. Fase de Actualización (Bloque 2): 
         Descarga el día actual y el horizonte de pronóstico. 
         Utiliza 'modo_append=True' para añadir esta información al bloque histórico 
@@ -22,58 +25,137 @@ Seguridad:
       de uso de la API gratuita y evitar bloqueos por execso de peticiones (429).
       
 Fujo general:
-    Para cada ciudad configurada:
-        -> bloque 1 (histórico)
-        -> Pausa
-        -> Bloque 2(forecast + datos recientes)
+    -> Bloque 1 (histórico): descarga concurrente de todas las ciudades
+    -> Pausa
+    -> Bloque 2 (forecast + datos recientes): descarga concurrente
+    La limpieza e inserción en SQLite de cada ciudad se hace de forma secuencial.
 """
 
+import logging
+import sys
 import time
 from datetime import date, timedelta
 from config.config import CIUDADES, START_DATE, END_DATE
+from data.downloader import descargar_datos_openmeteo_a_medida
 from data.get_data import get_data
+from db.database import borrar_indice_unico, crear_indice_unico, ultima_fecha
 
-def ingest():
+# Logger del módulo. Los handlers se configuran en el punto de entrada
+# (main.py, ingest.py), no aquí.
+logger = logging.getLogger(__name__)
+
+# Días ya guardados que se vuelven a descargar en la sincronización
+# incremental. Cubre el horizonte máximo del forecast de Open-Meteo (16 días):
+# los días que se guardaron como previsión se sustituyen por el dato real del
+# archivo, que además publica los últimos días con algo de retraso.
+DIAS_SOLAPE = 16
+
+def ingest(reconstruir=False):
     """
     Ejecuta el ciclo completo de descarga , limpieza y almacenamiento para todas 
     las ciudades configuradas en config.py
+
+    Parámetros:
+        reconstruir: bool, opcional
+            Si es True, recarga el histórico completo (2000 -> ayer) de todas
+            las ciudades, reemplazando el existente (p. ej. tras un cambio de
+            esquema). Por defecto False: sincronización incremental.
     
     Flujo:
         1. Calcular la fecha de ayer para cerrar el bloque histórico.
-        2. Para cada ciudad:
-            - Ejecuta el bloque histórico (2000-> ayer).
-            - Espera 5 segundo para evitar saturación de la API.
-            - Ejecuta el bloque de forecast (hoy -> hoy).
+        2. Bloque histórico (última fecha guardada -> ayer, o 2000 -> ayer si
+           se reconstruye): descarga concurrente de las ciudades y
+           limpieza/inserción de cada una en cuanto se descarga.
+        3. Espera 5 segundos para evitar saturación de la API.
+        4. Bloque de forecast (hoy -> hoy), con el mismo esquema.
     """
-    print(f">>> 🔄 INICIANDO CARGA TOTAL (2000 - PRESENTE)")
+    if reconstruir:
+        logger.info(">>> 🔄 INICIANDO CARGA TOTAL (2000 - PRESENTE)")
+    else:
+        logger.info(">>> 🔄 INICIANDO SINCRONIZACIÓN INCREMENTAL")
     
     # Calculamos la fecha de ayer para cerrar el bloque histórico de la API Archive
     ayer = (date.today() - timedelta(days=1)).strftime("%Y-%m-%d")
 
-    for ciudad in CIUDADES:
-        nombre = ciudad["nombre"]
-        lat, lon = ciudad["lat"], ciudad["lon"]
+    # Coordenadas de todas las ciudades: las descargas de cada bloque se lanzan
+    # a la vez y cada ciudad se limpia e inserta en cuanto llega su descarga,
+    # mientras las demás siguen en curso. Las inserciones se hacen de una en
+    # una desde este hilo (SQLite admite un único escritor).
+    ubicaciones = [(ciudad["lat"], ciudad["lon"]) for ciudad in CIUDADES]
 
-        # -----------------------------------------------------------------------
-        # BLOQUE 1: PROCESAMIENTO HISTÓRICO
-        # -----------------------------------------------------------------------
+    # -----------------------------------------------------------------------
+    # BLOQUE 1: PROCESAMIENTO HISTÓRICO
+    # -----------------------------------------------------------------------
+    # Se usa la API de Archivo Histórico de Open-Meteo.
+    if reconstruir:
         # Este bloque descarga el grueso de los datos (años de registros).
-        # Se usa la API de Archivo Histórico de Open-Meteo.
-        print(f"\n📚 Bloque 1: Procesando historial para {nombre}...")
-        get_data(nombre, lat, lon, fecha_ini=START_DATE, fecha_fin=ayer, modo_append=False)
-        
-        # Pausa de seguridad: Vital para prevenir errores 429 (Too Many Requests)
-        print("☕ Esperando 5 segundos para refrescar conexión...")
-        time.sleep(5)
-
-        # -----------------------------------------------------------------------
-        # BLOQUE 2: PROCESAMIENTO DE FORECAST Y DATOS RECIENTES
-        # -----------------------------------------------------------------------
-        # Este bloque cubre el día de hoy y los días futuros de pronóstico.
-        # Al usar modo_append=True, estos datos se "pegan" al final del histórico.
-        print(f"📡 Bloque 2: Añadiendo datos recientes y pronóstico...")
-        get_data(nombre, lat, lon, fecha_ini=END_DATE, fecha_fin=END_DATE, modo_append=True)
+        # El índice único (estacion, time) se elimina durante la carga: mantenerlo
+        # fila a fila en años de registros es mucho más lento que reconstruirlo
+        # una sola vez al final. Se recrea aunque la carga falle a medias.
+        logger.info(f"📚 Bloque 1: Descargando historial de {len(CIUDADES)} ciudad(es)...")
+        borrar_indice_unico()
+        try:
+            _cargar_historico(list(range(len(CIUDADES))), START_DATE, ayer, modo_append=False)
+        finally:
+            logger.info("🗂 Reconstruyendo índice único (estacion, time)...")
+            crear_indice_unico()
+    else:
+        # Cada ciudad se sincroniza desde su última fecha guardada (menos el
+        # margen de solape). Las ciudades con la misma fecha de inicio se
+        # descargan juntas; el UPSERT hace seguro reescribir el solape.
+        grupos = {}
+        for indice, ciudad in enumerate(CIUDADES):
+            grupos.setdefault(_inicio_incremental(ciudad["nombre"], ayer), []).append(indice)
+
+        for fecha_ini, indices in grupos.items():
+            logger.info(f"📚 Bloque 1: Sincronizando {len(indices)} ciudad(es) desde {fecha_ini}...")
+            _cargar_historico(indices, fecha_ini, ayer, modo_append=True)
+
+    # Pausa de seguridad: Vital para prevenir errores 429 (Too Many Requests)
+    logger.info("☕ Esperando 5 segundos para refrescar conexión...")
+    time.sleep(5)
+
+    # -----------------------------------------------------------------------
+    # BLOQUE 2: PROCESAMIENTO DE FORECAST Y DATOS RECIENTES
+    # -----------------------------------------------------------------------
+    # Este bloque cubre el día de hoy y los días futuros de pronóstico.
+    # Al usar modo_append=True, estos datos se "pegan" al final del histórico.
+    logger.info("📡 Bloque 2: Descargando datos recientes y pronóstico...")
+    for indice, df_bruto in descargar_datos_openmeteo_a_medida(ubicaciones, END_DATE, END_DATE):
+        ciudad = CIUDADES[indice]
+        logger.info(f"📡 Bloque 2: Añadiendo datos recientes y pronóstico para {ciudad['nombre']}...")
+        get_data(ciudad["nombre"], ciudad["lat"], ciudad["lon"],
+                 fecha_ini=END_DATE, fecha_fin=END_DATE, modo_append=True, df_bruto=df_bruto)
+
+
+def _inicio_incremental(nombre, ayer):
+    """
+    Fecha desde la que hay que descargar el histórico de una ciudad.
+
+    Es la última fecha guardada hasta ayer menos DIAS_SOLAPE, o START_DATE si
+    la ciudad aún no tiene datos.
+    """
+    ultima = ultima_fecha(nombre, hasta=ayer)
+    if ultima is None:
+        return START_DATE
+    inicio = (date.fromisoformat(ultima) - timedelta(days=DIAS_SOLAPE)).strftime("%Y-%m-%d")
+    return max(inicio, START_DATE)
+
+
+def _cargar_historico(indices, fecha_ini, fecha_fin, modo_append):
+    """
+    Descarga en paralelo el rango [fecha_ini, fecha_fin] de las ciudades
+    indicadas (índices de CIUDADES) y limpia e inserta cada una al llegar.
+    """
+    ubicaciones = [(CIUDADES[i]["lat"], CIUDADES[i]["lon"]) for i in indices]
+    for posicion, df_bruto in descargar_datos_openmeteo_a_medida(ubicaciones, fecha_ini, fecha_fin):
+        ciudad = CIUDADES[indices[posicion]]
+        logger.info(f"📚 Bloque 1: Procesando historial para {ciudad['nombre']}...")
+        get_data(ciudad["nombre"], ciudad["lat"], ciudad["lon"],
+                 fecha_ini=fecha_ini, fecha_fin=fecha_fin, modo_append=modo_append, df_bruto=df_bruto)
 
 if __name__ == "__main__":
-    # Punto de entrada para ejecución manual: 'python ingest.py'
-    ingest()
\ No newline at end of file
+    # Punto de entrada para ejecución manual: 'python ingest.py [--reconstruir]'
+    # Configuración única de logging para los módulos que usan logger
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    ingest(reconstruir="--reconstruir" in sys.argv)
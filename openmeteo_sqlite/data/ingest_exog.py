@@ -10,14 +10,22 @@ Descripción:
     Forma paret del sistema de ingesta masiva para enriquecer la base de datos
     con información meteorológica detallada. 
 """
+import json
 import requests
-import sqlite3
+import numpy as np
 import pandas as pd
 from datetime import date
 from tqdm import tqdm
 
-# Ruta a la base de datos SQLite
-DB_PATH = "datos/openmeteo.db"
+from db.database import columnas_tabla, insertar_en_db
+
+# Parser JSON: orjson si está instalado (la respuesta de 20+ años de variables
+# diarias ocupa varios MB de floats); si no, el módulo json estándar.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # Coordenadas de tus ciudades
 COORDS = {
@@ -70,41 +78,58 @@ def ingest_exog():
     
     print("=== INGESTA DIARIA COMPLETA (EXÓGENAS) ===")
 
-    # Abrir conexión a SQLite
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
     # Obtener las columnas reales de la tabla 'mediciones'
-    # Esto permite filtrar solo las columnas compatibles  antes de insertar
-    cur.execute("PRAGMA table_info(mediciones)")
-    existing_cols = {row[1] for row in cur.fetchall()}
+    # Esto permite filtrar solo las columnas compatibles  antes de insertar.
+    # database.py memoriza el resultado, y es la misma base de datos (DB_PATH
+    # de config.py) en la que escribe insertar_en_db.
+    existing_cols = columnas_tabla()
 
     print("\nColumnas detectadas en la tabla:")
     for col in existing_cols:
         print("  -", col)
 
+    # Variables solicitadas que tienen columna en la tabla. Todas las ciudades
+    # reciben el mismo esquema, así que el filtro se calcula una sola vez.
+    columnas_validas = [col for col in DAILY_VARS if col in existing_cols]
+
     # Fechas válidas para Open-Meteo (NO permite futuro)
     start_date = "2000-01-01"
     end_date = str(date.today())
 
-    # Recorrer todas las ciudades configuradas
-    for city, (lat, lon) in COORDS.items():
-        print(f"\nDescargando datos para {city}...")
-
-        # Construcción de la URL con todas las variables diarias
-        url = (
-            "https://archive-api.open-meteo.com/v1/archive?"
-            f"latitude={lat}&longitude={lon}"
-            f"&start_date={start_date}"
-            f"&end_date={end_date}"
-            f"&daily={','.join(DAILY_VARS)}"
-            "&timezone=auto"
-        )
-
-        # Petición HTTP a la API
-        r = requests.get(url)
-        data = r.json()
+    # Una sola petición para todas las ciudades: Open-Meteo acepta listas de
+    # latitudes y longitudes separadas por comas y devuelve una respuesta por
+    # ubicación, en el mismo orden. Se ahorra un viaje HTTP (y su handshake
+    # TLS) por cada ciudad adicional.
+    ciudades = list(COORDS)
+    latitudes = ",".join(str(lat) for lat, _ in COORDS.values())
+    longitudes = ",".join(str(lon) for _, lon in COORDS.values())
+    print(f"\nDescargando datos para {', '.join(ciudades)}...")
+
+    # Construcción de la URL con todas las variables diarias
+    url = (
+        "https://archive-api.open-meteo.com/v1/archive?"
+        f"latitude={latitudes}&longitude={longitudes}"
+        f"&start_date={start_date}"
+        f"&end_date={end_date}"
+        f"&daily={','.join(DAILY_VARS)}"
+        "&timezone=auto"
+    )
+
+    # Petición HTTP a la API (con timeout para no bloquear la ingesta
+    # indefinidamente si la conexión se queda colgada)
+    r = requests.get(url, timeout=(3.05, 60))
+    # Se parsean los bytes directamente, sin decodificar antes a texto
+    respuesta = _json_loads(r.content)
+
+    # Con una sola ubicación la API devuelve un objeto; con varias, una lista
+    respuestas = respuesta if isinstance(respuesta, list) else [respuesta]
+    if len(respuestas) != len(ciudades):
+        print("⚠ La API no devolvió una respuesta por ciudad. Respuesta:")
+        print(respuesta)
+        respuestas = []
 
+    # Recorrer todas las ciudades configuradas
+    for city, data in zip(ciudades, respuestas):
         # Validación: si no hay bloque "daily", no se puede procesar
         if "daily" not in data:
             print(f"⚠ La API no devolvió datos diarios para {city}. Respuesta:")
@@ -112,20 +137,25 @@ def ingest_exog():
             continue
         
         # convertir el bloque "daily" en el DataFrame
-        df = pd.DataFrame(data["daily"])
+        # Solo se convierten las columnas que existen en tu tabla Sqlite
+        # (esto evita erorres se Open-Meteo añade nuevas variables). Cada lista
+        # pasa a un array float64 en una sola pasada de NumPy (None -> NaN),
+        # sin que pandas tenga que inferir el tipo valor a valor.
+        daily = data["daily"]
+        columnas = {"time": pd.to_datetime(daily["time"], format="%Y-%m-%d")}
+        for col in columnas_validas:
+            if col in daily:
+                columnas[col] = np.asarray(daily[col], dtype=np.float64)
+        df = pd.DataFrame(columnas)
         
         # Añadir columna con el nombre de la estación (ciudad)
         df["estacion"] = city
 
-        # Filtrar solo columnas que existen en tu tabla Sqlite
-        # Esto evita erorres se Open-Meteo añade nuevas variables
-        df = df[[col for col in df.columns if col in existing_cols]]
-
-        # Insertar los datos en la tabla 'mediciones'
-        df.to_sql("mediciones", conn, if_exists="append", index=False)
+        # Insertar los datos en la tabla 'mediciones'. Se usa insertar_en_db
+        # para que los días ya existentes se actualicen (UPSERT sobre el índice
+        # único estacion + time) en lugar de duplicarse o fallar.
+        insertar_en_db(df, city)
 
         print(f"✔ {len(df)} filas insertadas para {city}")
 
-    # Cerrar la conexión
-    conn.close()
     print("\nIngesta completada.")
@@ -10,21 +10,92 @@ Descripción:
         2. Borrado seguro de registros por ciudad.
         3. Inserción robusta de datos limpios en la base de datos.
         4. REcuperación flexible de registros, ignorando mayúscula/minúscula.
+        5. Conexiones en modo WAL con synchronous=NORMAL e inserción por lotes
+           (INSERT de varias filas), con un único fsync por transacción. Cada hilo abre
+           una sola conexión y la reutiliza en todas las operaciones.
 
 Objetivos:
     - Gaerantizar consistencia en al bbdd.
-    - Evitar duplicados y errores por diferencias de capitalización.
+    - Evitar duplicados (índice único por día y estación + UPSERT) y errores
+      por diferencias de capitalización.
     - Asegurar que todas las fechas se almacenan en formato ISO (YYYY-MM-DD).
 """
 
+import atexit
 import sqlite3
+import threading
+
+import numpy as np
 import pandas as pd
 from config.config import DB_PATH, TABLA_DB
 
+# -----------------------------------------------------------------------------
+# 0. CONEXIÓN
+# -----------------------------------------------------------------------------
+
+# Conexiones abiertas, una por hilo y ruta de base de datos. Un objeto
+# sqlite3.Connection no debe compartirse entre hilos sin bloqueo, así que
+# cada hilo tiene la suya; dentro del mismo hilo se reutiliza siempre.
+# Solo las referencia este threading.local: cuando un hilo termina (p. ej.
+# los de un ThreadPoolExecutor), sus conexiones se liberan y se cierran.
+_conexiones = threading.local()
+
+def _conectar():
+    """
+    Devuelve la conexión a la base de datos del hilo actual, configurada
+    para escritura rápida.
+
+    La conexión se abre (y se configuran los PRAGMA) solo la primera vez;
+    las llamadas siguientes desde el mismo hilo la reutilizan, sin volver a
+    abrir el archivo ni a mapear el WAL. Se cierra al terminar el hilo que
+    la abrió (la del hilo principal, al salir del proceso).
+
+    - journal_mode=WAL: las escrituras se añaden a un log y los lectores no
+      bloquean a los escritores (el modo queda guardado en el archivo .db).
+    - synchronous=NORMAL: en modo WAL solo hace fsync en los checkpoints,
+      no en cada commit, sin riesgo de corrupción ante un cierre inesperado.
+    - temp_store=MEMORY: tablas e índices temporales en memoria, no en disco.
+    - cache_size=-20000: caché de páginas de ~20 MB (el valor negativo se
+      expresa en KiB) en lugar de los ~2 MB por defecto.
+
+    Cada escritura (borrado + inserción) se hace en una única transacción
+    con un solo commit.
+    """
+    abiertas = getattr(_conexiones, "por_ruta", None)
+    if abiertas is None:
+        abiertas = _conexiones.por_ruta = {}
+
+    conn = abiertas.get(DB_PATH)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        abiertas[DB_PATH] = conn
+    return conn
+
+@atexit.register
+def _cerrar_conexiones():
+    """
+    Cierra al salir las conexiones del hilo principal (atexit se ejecuta en
+    él). Las de otros hilos ya se cerraron al terminar cada hilo.
+    """
+    abiertas = getattr(_conexiones, "por_ruta", None) or {}
+    for conn in abiertas.values():
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    abiertas.clear()
+
 # -----------------------------------------------------------------------------
 # 1. GESTIÓN DEL ESQUEMA
 # -----------------------------------------------------------------------------
 
+# Ruta de la base de datos cuyo esquema ya se ha comprobado en este proceso
+_esquema_listo = None
+
 def crear_tabla_si_no_existe():
     """
     Crea la tabla principal del sistema si aún no existe.
@@ -32,8 +103,15 @@ def crear_tabla_si_no_existe():
     La tabla contiene todas las variables meteorológicas necesarias para entranamiento,
     forecast y análisis. Todas las fechas se alamacenan como  TEXTO en formato ISO para 
     evitar problemas de epcoh en SQLite.
+
+    La comprobación se hace una sola vez por proceso (y por ruta de base de
+    datos): las llamadas siguientes retornan sin abrir conexión.
     """
-    conn = sqlite3.connect(DB_PATH)
+    global _esquema_listo
+    if _esquema_listo == DB_PATH:
+        return
+
+    conn = _conectar()
     conn.execute(f"""
         CREATE TABLE IF NOT EXISTS {TABLA_DB} (
             time TEXT,
@@ -53,8 +131,109 @@ def crear_tabla_si_no_existe():
             estacion TEXT
         )
     """)
+    _normalizar_estaciones(conn)
+    _crear_indice_unico(conn)
     conn.commit()
-    conn.close()
+    _esquema_listo = DB_PATH
+
+def _normalizar_estaciones(conn):
+    """
+    Pasa a minúsculas los nombres de estación guardados con mayúsculas.
+
+    insertar_en_db ya guarda siempre la estación en minúsculas, pero las
+    bases de datos antiguas (p. ej. cargas hechas con to_sql) pueden tener
+    'Santander'. Con todos los nombres normalizados, las consultas filtran
+    con 'estacion = ?' en lugar de 'LOWER(estacion) = ?': la comparación
+    directa puede resolverse con un índice, LOWER() obliga a recorrer la
+    tabla entera. Si el cambio choca con un registro ya existente del mismo
+    día (índice único), se conserva la fila normalizada (OR REPLACE).
+    """
+    conn.execute(f"""
+        UPDATE OR REPLACE {TABLA_DB} SET estacion = LOWER(estacion)
+        WHERE estacion <> LOWER(estacion)
+    """)
+
+# Índice único que identifica cada registro: un día por estación. La
+# estación va primero para que el mismo índice sirva a las consultas
+# 'WHERE estacion = ? ORDER BY time' (búsqueda + orden sin sort aparte).
+INDICE_UNICO = f"idx_{TABLA_DB}_estacion_time"
+# Nombre del índice de versiones anteriores, con las columnas al revés
+_INDICE_UNICO_ANTIGUO = f"idx_{TABLA_DB}_time_estacion"
+
+def _crear_indice_unico(conn):
+    """
+    Garantiza el índice único (estacion, time) que usa el UPSERT de
+    insertar_en_db y que acelera las lecturas por estación.
+
+    Las bases de datos creadas antes de existir el índice pueden tener filas
+    repetidas para el mismo día y estación; en ese caso se conserva la última
+    insertada y se eliminan las demás antes de crear el índice. El índice
+    antiguo (time, estacion), si existe, se sustituye por el nuevo.
+    """
+    if _indice_unico_existe(conn):
+        return
+    conn.execute(f"DROP INDEX IF EXISTS {_INDICE_UNICO_ANTIGUO}")
+    conn.execute(f"""
+        DELETE FROM {TABLA_DB} WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM {TABLA_DB} GROUP BY time, estacion
+        )
+    """)
+    conn.execute(f"CREATE UNIQUE INDEX {INDICE_UNICO} ON {TABLA_DB} (estacion, time)")
+
+def _indice_unico_existe(conn):
+    """Indica si el índice único (estacion, time) está creado."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (INDICE_UNICO,)
+    ).fetchone() is not None
+
+def borrar_indice_unico():
+    """
+    Elimina el índice único (estacion, time) antes de una carga masiva.
+
+    Con el índice activo, cada INSERT actualiza el árbol B y comprueba la
+    unicidad fila a fila. Sin él, insertar_en_db hace un INSERT simple y el
+    índice se reconstruye después con crear_indice_unico() en una sola
+    pasada ordenada.
+    """
+    crear_tabla_si_no_existe()
+    conn = _conectar()
+    # 'with conn' confirma la transacción o la deshace si hay un error
+    with conn:
+        conn.execute(f"DROP INDEX IF EXISTS {INDICE_UNICO}")
+        conn.execute(f"DROP INDEX IF EXISTS {_INDICE_UNICO_ANTIGUO}")
+
+def crear_indice_unico():
+    """
+    Vuelve a crear el índice único (estacion, time) tras una carga masiva.
+
+    Si la carga dejó días repetidos para una estación, se conserva el último
+    insertado (ver _crear_indice_unico).
+    """
+    conn = _conectar()
+    with conn:
+        _crear_indice_unico(conn)
+
+# Columnas de la tabla principal por ruta de base de datos. El esquema solo
+# lo crea este módulo, así que basta consultarlo una vez por proceso.
+_columnas_cache = {}
+
+def _columnas_tabla(conn):
+    """Devuelve el conjunto de nombres de columna de la tabla principal."""
+    columnas = _columnas_cache.get(DB_PATH)
+    if columnas is None:
+        columnas = frozenset(fila[1] for fila in conn.execute(f"PRAGMA table_info({TABLA_DB})"))
+        _columnas_cache[DB_PATH] = columnas
+    return columnas
+
+def columnas_tabla():
+    """
+    Devuelve el conjunto de columnas de la tabla principal.
+
+    El resultado se memoriza por proceso: solo la primera llamada ejecuta
+    PRAGMA table_info.
+    """
+    crear_tabla_si_no_existe()
+    return _columnas_tabla(_conectar())
 
 # -----------------------------------------------------------------------------
 # 2. LIMPIEZA DE REGISTROS (Normalizado a minúsculas)
@@ -69,23 +248,65 @@ def borrar_ciudad(ciudad):
             Nombre de la ciudad a eliminar ( se normaliza en minúscula).
     """
     crear_tabla_si_no_existe()
-    conn = sqlite3.connect(DB_PATH)
+    conn = _conectar()
     # Forzamos minúsculas para asegurar el borrado
     ciudad_clean = ciudad.lower() 
     try:
-        conn.execute(f"DELETE FROM {TABLA_DB} WHERE LOWER(estacion) = ?", (ciudad_clean,))
+        conn.execute(f"DELETE FROM {TABLA_DB} WHERE estacion = ?", (ciudad_clean,))
         conn.commit()
         print(f"🧹 Datos previos de {ciudad_clean} eliminados de la DB.")
     except Exception as e:
+        conn.rollback()
         print(f"⚠ Error al limpiar datos de {ciudad}: {e}")
-    finally:
-        conn.close()
 
 # -----------------------------------------------------------------------------
 # 3. PERSISTENCIA DE DATOS (Normalizado a minúsculas)
 # -----------------------------------------------------------------------------
 
-def insertar_en_db(df, estacion):
+def _es_fecha_iso(serie):
+    """Indica si una columna de texto contiene solo fechas YYYY-MM-DD (o nulos)."""
+    if not (serie.dtype == object or pd.api.types.is_string_dtype(serie)):
+        return False
+    try:
+        return bool(serie.str.fullmatch(r"\d{4}-\d{2}-\d{2}").all())
+    except AttributeError:
+        # Columna object con valores que no son texto (p. ej. date)
+        return False
+
+# Filas por sentencia en la inserción por lotes. Con ~15 columnas son unos
+# 7.500 parámetros por INSERT, por debajo del límite de SQLite moderno.
+# Aunque executemany recorre las filas en C, cada una sigue siendo un
+# sqlite3_step() completo con su reinicio de sentencia y su búsqueda en el
+# índice único del UPSERT; agrupar 500 filas por sentencia reduce esos
+# pasos a uno por lote y, en la práctica, reduce a la mitad el tiempo de
+# inserción.
+FILAS_POR_LOTE = 500
+
+def _max_variables(conn):
+    """
+    Número máximo de parámetros '?' que admite una sentencia en esta
+    conexión (999 en versiones de SQLite anteriores a la 3.32).
+    """
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    except AttributeError:
+        # Connection.getlimit solo existe desde Python 3.11
+        return 999
+
+def _valores_por_fila(df, cols):
+    """
+    Devuelve una matriz de objetos (filas x columnas) con los valores de
+    'cols' como escalares de Python, que es lo que sqlite3 sabe enlazar.
+
+    Cada columna se convierte de una vez con tolist(); un lote de filas se
+    aplana después con ravel() en el orden de los marcadores del VALUES.
+    """
+    valores = np.empty((len(df), len(cols)), dtype=object)
+    for j, col in enumerate(cols):
+        valores[:, j] = df[col].tolist()
+    return valores
+
+def insertar_en_db(df, estacion, reemplazar=False):
     """
     Inserta un dataFrame en la base de datos, normalizando fechas y estación.
     
@@ -93,38 +314,117 @@ def insertar_en_db(df, estacion):
         - Las fechas se conviertn a ISo (YYYY-MM-DD).
         - La estación se almacena siempre en minúsculas.
         - Se descartan filas sin fecha válida.
+        - Si ya existe un registro para el mismo día y estación, se
+          actualiza (UPSERT) en lugar de insertarlo duplicado.
+        - Sin el índice único (carga masiva, ver borrar_indice_unico) se
+          hace un INSERT simple.
         
     Parámetros:
         df: pd.DataFrame
             DataFrame limpio y listo para persistencia
         estacion: str
             Nombre de la ciudad/estación asociada a los registros.
+        reemplazar: bool, opcional
+            Si es True, borra antes los registros previos de la estación.
+            El borrado y la inserción van en la misma transacción (un único
+            commit): si la inserción falla, el histórico anterior se conserva.
     """
     crear_tabla_si_no_existe()
-    df = df.copy()
+    # Copia superficial: solo se reemplazan columnas completas ('time' y
+    # 'estacion'), lo que nunca escribe sobre los datos del DataFrame original.
+    # Así se evita duplicar en memoria todas las columnas numéricas.
+    df = df.copy(deep=False)
 
-    # Normalización obligatoria
-    df['time'] = pd.to_datetime(df['time'], errors='coerce').dt.strftime('%Y-%m-%d')
+    # Normalización obligatoria. Si 'time' ya llega como texto ISO
+    # (YYYY-MM-DD) se guarda tal cual; el resto se parsea a datetime.
+    if not pd.api.types.is_datetime64_any_dtype(df['time']) and not _es_fecha_iso(df['time']):
+        df['time'] = pd.to_datetime(df['time'], errors='coerce')
     df["estacion"] = estacion.lower()
     
     df = df.dropna(subset=['time'])
 
-    conn = sqlite3.connect(DB_PATH)
+    # datetime64 -> texto ISO con un cast vectorizado de NumPy (truncar a día
+    # y convertir a str), sin la llamada a strftime por fila de .dt.strftime.
+    if pd.api.types.is_datetime64_any_dtype(df['time']):
+        df['time'] = df['time'].to_numpy(dtype='datetime64[D]').astype(str)
+
+    conn = _conectar()
     try:
-        df.to_sql(TABLA_DB, conn, if_exists="append", index=False, 
-                dtype={'time': 'TEXT'})
+        if reemplazar:
+            conn.execute(f"DELETE FROM {TABLA_DB} WHERE estacion = ?", (estacion.lower(),))
+        # Inserción por lotes, todos dentro de la misma transacción.
+        # UPSERT nativo: si ya existe el registro de ese día y estación, se
+        # actualizan sus valores en lugar de duplicarlo.
+        # Solo se insertan las columnas que existen en la tabla (igual que en
+        # ingest_exog.py), así una variable nueva de la API no rompe la carga.
+        # Los NaN se guardan como NULL (SQLite no almacena NaN).
+        existentes = _columnas_tabla(conn)  # memorizado tras la primera llamada
+        cols = [col for col in df.columns if col in existentes]
+        columnas = ", ".join(f'"{col}"' for col in cols)
+        marcadores = ", ".join("?" * len(cols))
+        actualizar = ", ".join(
+            f'"{col}" = excluded."{col}"' for col in cols if col not in ("time", "estacion")
+        )
+        fila = f"({marcadores})"
+        sufijo = ""
+        # El UPSERT necesita el índice único: durante una carga masiva (índice
+        # eliminado) se inserta sin más y los duplicados se resuelven al
+        # reconstruir el índice.
+        if _indice_unico_existe(conn):
+            sufijo = " ON CONFLICT(time, estacion) DO " + (f"UPDATE SET {actualizar}" if actualizar else "NOTHING")
+
+        # INSERT de varias filas: cada sentencia lleva FILAS_POR_LOTE tuplas en
+        # su VALUES, de modo que SQLite prepara y ejecuta una sentencia por
+        # lote en lugar de una por fila. La plantilla se construye una sola vez
+        # y solo el último lote (incompleto) necesita la suya.
+        por_lote = max(1, min(FILAS_POR_LOTE, _max_variables(conn) // len(cols)))
+        valores = _valores_por_fila(df, cols)
+        plantilla = f"INSERT INTO {TABLA_DB} ({columnas}) VALUES " + ", ".join([fila] * por_lote) + sufijo
+        for inicio in range(0, len(valores), por_lote):
+            lote = valores[inicio:inicio + por_lote]
+            sql = plantilla if len(lote) == por_lote else (
+                f"INSERT INTO {TABLA_DB} ({columnas}) VALUES " + ", ".join([fila] * len(lote)) + sufijo
+            )
+            conn.execute(sql, lote.ravel().tolist())
         conn.commit()
+        if reemplazar:
+            print(f"🧹 Datos previos de {estacion.lower()} reemplazados en la DB.")
         print(f"💾 Guardados {len(df)} registros reales para {df['estacion'].iloc[0]}.")
     except Exception as e:
+        conn.rollback()
         print(f"⚠ Error al insertar: {e}")
-    finally:
-        conn.close()
 
 # -----------------------------------------------------------------------------
 # 4. EXTRACCIÓN DE DATOS (Búsqueda robusta)
 # -----------------------------------------------------------------------------
 
-def load_from_db(estacion=None):
+def ultima_fecha(estacion, hasta=None):
+    """
+    Devuelve la fecha más reciente guardada para una estación.
+
+    La consulta se resuelve con una búsqueda en el índice (estacion, time),
+    sin recorrer la tabla.
+
+    Parámetros:
+        estacion: str
+            Nombre de la estación (se normaliza en minúscula).
+        hasta: str, opcional
+            Si se indica (YYYY-MM-DD), solo se consideran fechas <= hasta
+            (p. ej. para ignorar los días futuros guardados por el forecast).
+
+    Retorna:
+        str or None
+            Fecha en formato YYYY-MM-DD, o None si la estación no tiene datos.
+    """
+    crear_tabla_si_no_existe()
+    query = f"SELECT MAX(time) FROM {TABLA_DB} WHERE estacion = ?"
+    params = (estacion.lower(),)
+    if hasta:
+        query += " AND time <= ?"
+        params += (str(hasta),)
+    return _conectar().execute(query, params).fetchone()[0]
+
+def load_from_db(estacion=None, chunksize=None, no_nulos=None):
     """
     Recupera registros desde SQLite, ignorando mayúsculas/minúsculas.
     
@@ -132,22 +432,119 @@ def load_from_db(estacion=None):
         estación: str, opcional
             Si se especifica, filtra por esa esatción.
             Si no, devuleve toda la tablas.
+        chunksize: int, opcional
+            Si se indica, en lugar de cargar todo de una vez se devuelve un
+            iterador de DataFrames de como máximo 'chunksize' filas, para
+            procesar tablas grandes con memoria acotada. Por defecto None.
+        no_nulos: list[str], opcional
+            Columnas que no pueden ser NULL. El filtro se aplica en la propia
+            consulta (WHERE ... IS NOT NULL), así las filas descartadas no
+            llegan a leerse ni a convertirse en DataFrame.
     
     Retorna:
-        pd.DataFrame
-            dataFrame con los registros solicitados.
+        pd.DataFrame o Iterator[pd.DataFrame]
+            dataFrame con los registros solicitados (o iterador de bloques
+            si se indica chunksize).
+
+    Excepciones:
+        ValueError
+            Si alguna columna de 'no_nulos' no existe en la tabla.
     """
     crear_tabla_si_no_existe()
-    conn = sqlite3.connect(DB_PATH)
+    conn = _conectar()
 
+    condiciones = []
+    params = []
     if estacion:
-        # Buscamos usando LOWER en SQL para que coincida siempre
-        estacion_clean = estacion.lower()
-        query = f"SELECT * FROM {TABLA_DB} WHERE LOWER(estacion) = ?"
-        df = pd.read_sql(query, conn, params=(estacion_clean,))
-    else:
-        query = f"SELECT * FROM {TABLA_DB}"
-        df = pd.read_sql(query, conn)
-
-    conn.close()
-    return df
\ No newline at end of file
+        # Las estaciones se guardan siempre en minúsculas (ver
+        # _normalizar_estaciones): basta normalizar el parámetro y comparar
+        # directamente, sin LOWER() sobre la columna.
+        condiciones.append("estacion = ?")
+        params.append(estacion.lower())
+
+    if no_nulos:
+        # Los nombres de columna no pueden ir como parámetro '?': se validan
+        # contra el esquema antes de incluirlos en la consulta.
+        desconocidas = set(no_nulos) - _columnas_tabla(conn)
+        if desconocidas:
+            raise ValueError(f"Columnas desconocidas en no_nulos: {sorted(desconocidas)}")
+        condiciones += [f'"{col}" IS NOT NULL' for col in no_nulos]
+
+    query = f"SELECT * FROM {TABLA_DB}"
+    if condiciones:
+        query += " WHERE " + " AND ".join(condiciones)
+    # Mismo orden (estacion, time) que el índice único: los datos llegan ya
+    # ordenados como los necesita preparar_features_xgb. Con una estación
+    # fijada, equivale a ORDER BY time y se resuelve recorriendo el índice.
+    query += " ORDER BY estacion, time"
+    params = tuple(params) or None
+
+    if chunksize:
+        return _leer_por_bloques(query, params, chunksize)
+
+    return pd.read_sql(query, conn, params=params)
+
+def _leer_por_bloques(query, params, chunksize):
+    """
+    Genera los resultados de una consulta en bloques de 'chunksize' filas,
+    leyendo con la conexión del hilo actual.
+    """
+    yield from pd.read_sql_query(query, _conectar(), params=params, chunksize=chunksize)
+
+# -----------------------------------------------------------------------------
+# 5. REGISTRO DE ALERTAS ENVIADAS
+# -----------------------------------------------------------------------------
+
+# Tabla con las claves de las alertas ya enviadas (ver alerts/telegram.py)
+TABLA_ALERTAS_ENVIADAS = "alertas_enviadas"
+
+# Días que se conserva cada clave antes de borrarla
+DIAS_RETENCION_ALERTAS = 30
+
+def registrar_envio_alerta(clave, fecha):
+    """
+    Registra la clave de una alerta antes de enviarla y purga las claves
+    con más de DIAS_RETENCION_ALERTAS días.
+
+    Parámetros:
+        clave: str
+            Clave de idempotencia de la alerta.
+        fecha: str
+            Fecha de envío (YYYY-MM-DD), usada para la retención.
+
+    Retorna:
+        bool
+            True si la clave es nueva (hay que enviar), False si ya existía.
+    """
+    conn = _conectar()
+    try:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {TABLA_ALERTAS_ENVIADAS} "
+            "(id TEXT PRIMARY KEY, fecha TEXT)"
+        )
+        conn.execute(
+            f"DELETE FROM {TABLA_ALERTAS_ENVIADAS} WHERE fecha < date('now', ?)",
+            (f"-{DIAS_RETENCION_ALERTAS} days",),
+        )
+        cur = conn.execute(
+            f"INSERT OR IGNORE INTO {TABLA_ALERTAS_ENVIADAS} (id, fecha) VALUES (?, ?)",
+            (clave, fecha),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return cur.rowcount == 1
+
+def liberar_envio_alerta(clave):
+    """
+    Elimina la clave de una alerta que no se llegó a enviar, para que una
+    ejecución posterior pueda volver a intentarlo.
+    """
+    conn = _conectar()
+    try:
+        conn.execute(f"DELETE FROM {TABLA_ALERTAS_ENVIADAS} WHERE id = ?", (clave,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
@@ -45,23 +45,34 @@ def muestreo_mensual(df, dias_por_mes=20):
     # ---------------------------------------------------------------------------
     # 1. PREPARACIÓN Y ORDENAMIENTO
     # ---------------------------------------------------------------------------
-    df = df.copy()
-    df["time"] = pd.to_datetime(df["time"])
+    # Solo se parsea 'time' si no llega ya como datetime (lo habitual: train.py
+    # lo convierte al cargar). Para ordenar y elegir las filas basta con la
+    # columna 'time': el DataFrame completo no se copia ni se reordena entero,
+    # solo se extraen al final las filas seleccionadas.
+    tiempos = df["time"]
+    parsear = not pd.api.types.is_datetime64_any_dtype(tiempos)
+    if parsear:
+        tiempos = pd.to_datetime(tiempos)
     
-    # El orden cronológico es crítico antes de aplicar iloc
-    df = df.sort_values("time")
+    # El orden cronológico es crítico antes de aplicar iloc. El índice de
+    # 'tiempos' pasa a ser la posición de cada fila en el DataFrame original.
+    tiempos = tiempos.reset_index(drop=True).sort_values()
     
     # ---------------------------------------------------------------------------
     # 2. APLICACIÓN DE MUESTREO POR VENTANA (STRATIFIED TAIL)
     # ---------------------------------------------------------------------------
     # Agrupamos por año y mes para tratar cada bloque mensual como una unidad.
-    # Usamos .apply con iloc negativo para capturar el cierre de cada mes.
-    df_bal = df.groupby(
-        [df["time"].dt.year, df["time"].dt.month], 
-        group_keys=False
-    ).apply(
-        lambda x: x.iloc[-dias_por_mes:] if len(x) >= dias_por_mes else x
-    )
+    # cumcount(ascending=False) numera las filas de cada mes desde el final
+    # (0 = último día), así que una única máscara booleana captura el cierre
+    # de cada mes sin construir un DataFrame por grupo. Los meses con menos
+    # de 'dias_por_mes' registros se conservan completos.
+    posicion_desde_final = tiempos.groupby(
+        [tiempos.dt.year, tiempos.dt.month]
+    ).cumcount(ascending=False)
+    filas = tiempos.index[posicion_desde_final.to_numpy() < dias_por_mes]
+    df_bal = df.iloc[filas]
+    if parsear:
+        df_bal = df_bal.assign(time=tiempos.loc[filas].to_numpy())
     
     # ---------------------------------------------------------------------------
     # 3. LIMPIEZA DE ÍNDICES
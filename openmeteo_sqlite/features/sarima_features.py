@@ -16,6 +16,7 @@ Descripción:
     estrictamente regular. Este módulo asegura todas esas condiciones.
 """
 
+import numpy as np
 import pandas as pd
 
 
@@ -47,56 +48,75 @@ def preparar_serie_sarima(df):
         Si la serie queda vacía tras el preprocesado.
     """
     #--------------------------------------------------------------------------------
-    # 1. Seleccionar únicamente las columnas necesarias
-    #    Esto evita arratar columnas irrelevantes al modelo SARIMA
-    #--------------------------------------------------------------------------------
-    df_sarima = df[["time", "temperature_2m_mean"]].copy()
-
-    #--------------------------------------------------------------------------------
-    # 2. Convertir 'time' a datetime y eliminar fechas inválidas
+    # 1 y 2. Extraer solo las columnas necesarias como arrays NumPy, convertir
+    #    'time' a datetime y eliminar fechas inválidas
+    #    Se trabaja sobre arrays en lugar de copias sucesivas del DataFrame.
     #    errors="coerce" convierte valores no parseables en NaT.
     #--------------------------------------------------------------------------------
-    df_sarima["time"] = pd.to_datetime(df_sarima["time"], errors="coerce")
-    df_sarima = df_sarima.dropna(subset=["time"])
+    tiempos = df["time"]
+    if not pd.api.types.is_datetime64_any_dtype(tiempos):
+        tiempos = pd.to_datetime(tiempos, errors="coerce")
+    tiempos = tiempos.to_numpy()
+    valores = df["temperature_2m_mean"].to_numpy(dtype=np.float64, na_value=np.nan)
+    validas = ~np.isnat(tiempos)
+    tiempos, valores = tiempos[validas], valores[validas]
 
-    #--------------------------------------------------------------------------------
-    # 3. Ordenar por fecha para garantizar consistencia temporal
-    #--------------------------------------------------------------------------------
-    df_sarima = df_sarima.sort_values("time")
+    # Validación: la serie no puede quedar vacía. Con al menos una fecha
+    # válida, los pasos siguientes siempre producen una serie no vacía.
+    if len(tiempos) == 0:
+        raise ValueError(
+            "La serie SARIMA está vacía después de preparar_serie_sarima. "
+            "Revisa si el DataFrame original contiene datos válidos."
+        )
 
     #--------------------------------------------------------------------------------
-    # 4. Agrupar por fecha (día) y hacer media
-    #    Esto elimina duplicados y asegura un valor único por día.
-    #--------------------------------------------------------------------------------
-    df_sarima = df_sarima.groupby("time").mean()
+    # 3 y 4. Ordenar por fecha y hacer la media de cada día
+    #    Solo si hace falta: np.unique devuelve las fechas ordenadas y, para
+    #    cada fila, la posición de su fecha; con dos bincount se obtiene la
+    #    media de los duplicados (ignorando NaN, como groupby().mean()) sin
+    #    construir un DataFrame.
+    #--------------------------------------------------------------------------------
+    if len(tiempos) == 1 or (tiempos[1:] > tiempos[:-1]).all():
+        # Caso habitual (load_from_db devuelve la serie ordenada y el índice
+        # único impide duplicados): fechas ya estrictamente crecientes, no
+        # hay nada que ordenar ni promediar.
+        fechas, medias = tiempos, valores
+    else:
+        fechas, posicion = np.unique(tiempos, return_inverse=True)
+        con_valor = ~np.isnan(valores)
+        sumas = np.bincount(posicion[con_valor], weights=valores[con_valor], minlength=len(fechas))
+        cuentas = np.bincount(posicion[con_valor], minlength=len(fechas))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            medias = sumas / cuentas  # días sin ningún valor -> NaN
 
     #--------------------------------------------------------------------------------
     # 5. Asegurar frecuencia diaria fija
-    #    asfreq("D") crea una fila por día, insertando NaN donde falten datos
-    #--------------------------------------------------------------------------------
-    df_sarima = df_sarima.asfreq("D")
+    #    Igual que asfreq("D"): un hueco por día desde la primera fecha hasta
+    #    la última, con NaN donde falten datos.
+    #--------------------------------------------------------------------------------
+    un_dia = np.timedelta64(1, "D")
+    desplazamiento = fechas - fechas[0]
+    en_rejilla = desplazamiento % un_dia == np.timedelta64(0)
+    n_dias = int((fechas[-1] - fechas[0]) // un_dia) + 1
+    serie = np.full(n_dias, np.nan)
+    serie[desplazamiento[en_rejilla] // un_dia] = medias[en_rejilla]
 
     #--------------------------------------------------------------------------------
     # 6. Interpolación + forward fill
-    #    - interpolate(): rellena huecos suavemente
-    #    - ffill(): rellena valores iniciales se empiezan en NaN
-    #--------------------------------------------------------------------------------
-    df_sarima["temperature_2m_mean"] = (
-        df_sarima["temperature_2m_mean"]
-        .interpolate()
-        .ffill()
-    )
+    #    - np.interp rellena huecos linealmente y repite el último valor al
+    #      final (lo mismo que interpolate().ffill()).
+    #    - Como interpolate(), no se rellenan los NaN iniciales.
+    #--------------------------------------------------------------------------------
+    conocidos = np.flatnonzero(~np.isnan(serie))
+    if len(conocidos) > 0:
+        huecos = np.flatnonzero(np.isnan(serie))
+        huecos = huecos[huecos > conocidos[0]]
+        serie[huecos] = np.interp(huecos, conocidos, serie[conocidos])
 
-    #--------------------------------------------------------------------------------
-    # 7. Validación final: la serie no puede quedar vacia
-    #--------------------------------------------------------------------------------
-    if df_sarima.empty:
-        raise ValueError(
-            "La serie SARIMA está vacía después de preparar_serie_sarima. "
-            "Revisa si el DataFrame original contiene datos válidos."
-        )
+    # Se conserva la resolución (ns/us) de las fechas de entrada
+    indice = pd.DatetimeIndex(fechas[0] + np.arange(n_dias) * un_dia, freq="D", name="time")
 
     #--------------------------------------------------------------------------------
-    # 8. Devolver solo la serie univariada
+    # 7. Devolver solo la serie univariada
     #--------------------------------------------------------------------------------
-    return df_sarima["temperature_2m_mean"]
+    return pd.Series(serie, index=indice, name="temperature_2m_mean")
@@ -26,6 +26,72 @@ Estrategia de predicción:
 import pandas as pd
 import numpy as np
 
+# Seno y coseno del día del año precalculados: dayofyear es un entero entre
+# 1 y 366, así que basta indexar la tabla en lugar de evaluar sin/cos en
+# cada fila (y en cada paso de la predicción recursiva).
+_DIAS_ANIO = np.arange(367)
+_SIN_DOY = np.sin(2 * np.pi * _DIAS_ANIO / 365.25)
+_COS_DOY = np.cos(2 * np.pi * _DIAS_ANIO / 365.25)
+
+# Filas consecutivas (incluida la propia) que necesita preparar_features_xgb
+# para calcular las features de una fila: el retardo más largo es la
+# tendencia de presión a 3 días (diff(3)). Con un histórico sin nulos, las
+# features de la última fila de las últimas FILAS_CONTEXTO son las mismas
+# que con el histórico completo.
+FILAS_CONTEXTO = 4
+
+def _campos_fecha(tiempos):
+    """
+    Día del año, mes y día de la semana (lunes = 0) de una columna datetime,
+    con los mismos valores y tipo (int32) que .dt.dayofyear/.dt.month/
+    .dt.dayofweek, pero con aritmética sobre datetime64 de NumPy en lugar
+    de tres accesos .dt (el coste fijo de cada acceso domina en la
+    predicción recursiva, que procesa unas pocas filas por paso).
+    """
+    dias = tiempos.to_numpy().astype("datetime64[D]")
+    if np.isnat(dias).any():
+        # Con fechas nulas, pandas devuelve NaN en esas filas
+        return tiempos.dt.dayofyear, tiempos.dt.month, tiempos.dt.dayofweek
+    meses = dias.astype("datetime64[M]")
+    inicio_anio = meses.astype("datetime64[Y]").astype("datetime64[D]")
+    n_dia = dias.view(np.int64)  # días desde 1970-01-01, que fue jueves
+    dia_del_anio = (n_dia - inicio_anio.view(np.int64) + 1).astype(np.int32)
+    mes = (meses.view(np.int64) % 12 + 1).astype(np.int32)
+    dia_semana = ((n_dia + 3) % 7).astype(np.int32)
+    return dia_del_anio, mes, dia_semana
+
+def _ordenado_por_estacion_y_fecha(df):
+    """
+    Indica si el DataFrame ya está ordenado por (estacion, time), comparando
+    cada fila con la anterior en una sola pasada vectorizada.
+    """
+    if len(df) < 2:
+        return True
+    estaciones = df["estacion"].to_numpy()
+    tiempos = df["time"].to_numpy()
+    try:
+        misma = estaciones[1:] == estaciones[:-1]
+        en_orden = (estaciones[1:] > estaciones[:-1]) | (misma & (tiempos[1:] >= tiempos[:-1]))
+    except TypeError:
+        # Estaciones no comparables (p. ej. nulos): se deja a sort_values
+        return False
+    return bool(en_orden.all())
+
+def _rellenar_huecos(df):
+    """
+    Equivalente a df.ffill().bfill().infer_objects(copy=False).fillna(0),
+    pero recorriendo solo las columnas que lo necesitan: las que tienen
+    algún nulo y las de tipo object (por la inferencia de tipos). El resto
+    se conserva tal cual, sin las tres pasadas completas sobre la tabla.
+    En la predicción recursiva la fila suele llegar ya sin nulos y no se
+    rellena nada.
+    """
+    con_nulos = df.isna().any()
+    cols = [col for col, tipo in df.dtypes.items() if con_nulos[col] or tipo == object]
+    if not cols:
+        return df
+    return df.assign(**df[cols].ffill().bfill().infer_objects(copy=False).fillna(0))
+
 def preparar_features_xgb(df, modo_entrenamiento=True):
     """
     Transforma el DataFrame original en una matriz de entrenamiento/predicción.
@@ -44,19 +110,51 @@ def preparar_features_xgb(df, modo_entrenamiento=True):
         pd.DataFrame
             DataFrame enriquecido con todas las features necesarias para XGBoost.
     """
-    df = df.copy()
-    # Aseguramos el orden cronológico por estación para que los 'diff' y 'shift' sean correctos
-    df = df.sort_values(["estacion", "time"]).reset_index(drop=True)
+    # Aseguramos el orden cronológico por estación para que los 'diff' y 'shift' sean correctos.
+    # Si ya llega ordenado (p. ej. desde load_from_db) no se vuelve a ordenar.
+    if _ordenado_por_estacion_y_fecha(df):
+        df = df.reset_index(drop=True)
+    else:
+        df = df.sort_values(["estacion", "time"]).reset_index(drop=True)
+
+    # Códigos enteros de la estación, calculados una sola vez. Como el
+    # DataFrame está ordenado por (estacion, time), cada estación ocupa un
+    # tramo contiguo: los shift/diff por estación se resuelven desplazando
+    # arrays NumPy y anulando las filas cuyo origen cae en otra estación,
+    # sin un groupby (ni un rehash de las claves) por cada columna.
+    codigos, _ = pd.factorize(df["estacion"])
+
+    def _desplazar(col, k):
+        """Equivalente a df.groupby('estacion')[col].shift(k) (k >= 1)."""
+        valores = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        desplazado = np.full(len(valores), np.nan)
+        if k < len(valores):
+            misma = (codigos[k:] == codigos[:-k]) & (codigos[k:] >= 0)
+            desplazado[k:] = np.where(misma, valores[:-k], np.nan)
+        return desplazado
+
+    # Las columnas nuevas se reúnen en un diccionario y se añaden al final
+    # de una sola vez: asignarlas una a una fragmenta el DataFrame (un bloque
+    # interno por columna) y obliga a consolidarlo repetidamente.
+    nuevas = {}
 
     # ---------------------------------------------------------------------------
     # 1. FEATURES TEMPORALES (Ciclos Estacionales)
     # ---------------------------------------------------------------------------
     # Convertimos el día del año en coordenadas circulares
-    df["dayofyear"] = df["time"].dt.dayofyear
-    df["month"] = df["time"].dt.month
-    df["dayofweek"] = df["time"].dt.dayofweek
-    df["sin_doy"] = np.sin(2 * np.pi * df["dayofyear"] / 365.25)
-    df["cos_doy"] = np.cos(2 * np.pi * df["dayofyear"] / 365.25)
+    nuevas["dayofyear"], nuevas["month"], nuevas["dayofweek"] = _campos_fecha(df["time"])
+    dias = np.asarray(nuevas["dayofyear"], dtype=np.float64)
+    validas = ~np.isnan(dias)
+    if validas.all():
+        dias = dias.astype(np.intp)
+        nuevas["sin_doy"] = _SIN_DOY[dias]
+        nuevas["cos_doy"] = _COS_DOY[dias]
+    else:
+        # Fechas nulas (NaT): dayofyear es NaN y no sirve como índice, así
+        # que se consulta la tabla con 0 y esas filas quedan a NaN
+        dias = np.where(validas, dias, 0).astype(np.intp)
+        nuevas["sin_doy"] = np.where(validas, _SIN_DOY[dias], np.nan)
+        nuevas["cos_doy"] = np.where(validas, _COS_DOY[dias], np.nan)
 
     # ---------------------------------------------------------------------------
     # 2. LAGS DEL RESIDUO (Memoria de error del SARIMA)
@@ -65,25 +163,39 @@ def preparar_features_xgb(df, modo_entrenamiento=True):
     lags_res = [1, 2] 
     if "residuo" in df.columns:
         for lag in lags_res:
-            df[f"residuo_lag_{lag}"] = df.groupby("estacion")["residuo"].shift(lag)
+            nuevas[f"residuo_lag_{lag}"] = _desplazar("residuo", lag)
     else:
         # En fase inicial o forecast puro donde no hay residuo real
         for lag in lags_res:
-            df[f"residuo_lag_{lag}"] = 0.0
+            nuevas[f"residuo_lag_{lag}"] = 0.0
 
     # ---------------------------------------------------------------------------
     # 3. METEOROLOGÍA AVANZADA (Tendencias e Inercia)
     # ---------------------------------------------------------------------------
     meteo_cols = ["wind_direction_10m_dominant", "relative_humidity_2m", "surface_pressure", "wind_speed_10m"]
 
+    # Diferencia simple: Detecta si la variable sube o baja respecto a ayer.
+    # Se calcula para todas las columnas a la vez sobre un único array 2D
+    # (sin un groupby por columna): la primera fila de cada estación no
+    # tiene día anterior y, como los NaN, queda a 0.
+    presentes = [col for col in meteo_cols if col in df.columns]
+    if presentes:
+        bloque = df[presentes].to_numpy(dtype=np.float64, na_value=np.nan)
+        diferencias = np.empty_like(bloque)
+        diferencias[1:] = bloque[1:] - bloque[:-1]
+        inicio_estacion = np.ones(len(df), dtype=bool)
+        inicio_estacion[1:] = codigos[1:] != codigos[:-1]
+        diferencias[inicio_estacion] = 0.0
+        diferencias[np.isnan(diferencias)] = 0.0
+        diff_por_col = dict(zip(presentes, diferencias.T))
+
     for col in meteo_cols:
         if col in df.columns:
-            df[f"feat_{col}"] = df[col].astype(float)
-            # Diferencia simple: Detecta si la variable sube o baja respecto a ayer
-            df[f"diff_{col}"] = df.groupby("estacion")[col].diff().fillna(0)
+            nuevas[f"feat_{col}"] = df[col].astype(float)
+            nuevas[f"diff_{col}"] = diff_por_col[col]
         else:
-            df[f"feat_{col}"] = 0.0
-            df[f"diff_{col}"] = 0.0
+            nuevas[f"feat_{col}"] = 0.0
+            nuevas[f"diff_{col}"] = 0.0
 
     # ---------------------------------------------------------------------------
     # 4. MEJORAS ESPECÍFICAS PARA SANTANDER (Lógica Geográfica)
@@ -92,31 +204,48 @@ def preparar_features_xgb(df, modo_entrenamiento=True):
         # Transformación circular: El viento de componente Norte (mar) suele ser
         # más fresco en verano y estable en invierno que el componente Sur.
         rad = np.deg2rad(df["wind_direction_10m_dominant"].astype(float))
-        df["feat_viento_norte"] = np.cos(rad) # +1 es Norte puro, -1 es Sur puro
-        df["feat_viento_este"] = np.sin(rad)
+        nuevas["feat_viento_norte"] = np.cos(rad) # +1 es Norte puro, -1 es Sur puro
+        nuevas["feat_viento_este"] = np.sin(rad)
 
     if "surface_pressure" in df.columns:
         # Tendencia de presión a 3 días: Clave para detectar frentes atlánticos
-        df["diff_pressure_3d"] = df.groupby("estacion")["surface_pressure"].diff(3).fillna(0)
+        presion = df["surface_pressure"].to_numpy(dtype=np.float64, na_value=np.nan)
+        nuevas["diff_pressure_3d"] = np.nan_to_num(presion - _desplazar("surface_pressure", 3), nan=0.0)
 
     if "temperature_2m_mean" in df.columns:
         # Aceleración térmica: ¿Se está calentando el ambiente más rápido que ayer?
-        df["accel_temp"] = df.groupby("estacion")["temperature_2m_mean"].diff().shift(1).fillna(0)
+        # Diferencia por estación, desplazada un día sobre la tabla completa
+        # (como el diff().shift(1) original, el shift no es por estación)
+        temperatura = df["temperature_2m_mean"].to_numpy(dtype=np.float64, na_value=np.nan)
+        diferencia = temperatura - _desplazar("temperature_2m_mean", 1)
+        aceleracion = np.full(len(diferencia), np.nan)
+        aceleracion[1:] = diferencia[:-1]
+        nuevas["accel_temp"] = np.nan_to_num(aceleracion, nan=0.0)
+
+    # Las features decimales se guardan en float32, el tipo con el que
+    # XGBoost trabaja internamente: se calculan en float64 (mismos valores
+    # que antes) y se convierten una sola vez, lo que reduce a la mitad la
+    # memoria de la matriz y evita la conversión al construir el DMatrix.
+    df_nuevas = pd.DataFrame(nuevas, index=df.index)
+    df_nuevas = df_nuevas.astype({col: np.float32 for col, tipo in df_nuevas.dtypes.items() if tipo == np.float64})
+    df = pd.concat([df.drop(columns=df.columns.intersection(list(nuevas))), df_nuevas], axis=1)
 
     # ---------------------------------------------------------------------------
     # 5. POST-PROCESAMIENTO Y LIMPIEZA
     # ---------------------------------------------------------------------------
     if "sarima_pred" in df.columns:
-        df["sarima_pred"] = df["sarima_pred"].astype(float)
+        df["sarima_pred"] = df["sarima_pred"].astype(np.float32)
 
     if modo_entrenamiento:
         # Eliminamos filas iniciales donde los lags son NaN (sin historia previa)
-        cols_con_lags = [c for c in df.columns if "lag_" in c]
-        df = df.dropna(subset=cols_con_lags)
+        # Las columnas de lags son conocidas: una única máscara NumPy sobre
+        # ellas, sin buscar 'lag_' en todos los nombres de columna.
+        cols_con_lags = [f"residuo_lag_{lag}" for lag in lags_res]
+        con_historia = ~np.isnan(df[cols_con_lags].to_numpy(dtype=np.float64)).any(axis=1)
+        df = df[con_historia]
     else:
         # En modo producción rellenamos para evitar que el XGBoost rechace la fila
-        df = df.ffill().bfill()
-        df = df.infer_objects(copy=False).fillna(0)
+        df = _rellenar_huecos(df)
 
     return df.reset_index(drop=True)
 
@@ -137,7 +266,16 @@ def generar_features_futuras(historial, sarima_preds, step, meteo_futura=None):
         pd.DataFrame
             Una única fila con todas las features necesarias para XGBoost
     """
-    df = historial.copy()
+    # Solo se usan las últimas filas del histórico: las features de la nueva
+    # fila no dependen de días anteriores a FILAS_CONTEXTO, y así cada paso
+    # cuesta lo mismo sea cual sea la longitud del histórico. Si ya viene
+    # ordenado (lo habitual) basta con tail(); si no, nlargest() selecciona
+    # esas filas en O(N) sin ordenar el histórico entero.
+    n_filas = FILAS_CONTEXTO - 1
+    if historial["time"].is_monotonic_increasing:
+        df = historial.tail(n_filas)
+    else:
+        df = historial.nlargest(n_filas, "time", keep="last").sort_values("time", kind="stable")
     ultima_fecha = df["time"].max()
     fecha_futura = ultima_fecha + pd.Timedelta(days=1)
     
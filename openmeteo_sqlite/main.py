@@ -23,10 +23,11 @@ Nota:
 """
 
 import argparse
+import logging
 import sys
 
 from data.ingest import ingest
-from pipeline.forecast import predecir_hibrido
+from pipeline.forecast import cargar_historial, predecir_hibrido
 from pipeline.train import entrenar_modelos, entrenar_modelos_mensual
 
 # Valores por defecto centralizados para facilitar el mantenimiento
@@ -61,8 +62,17 @@ def main():
         help="Número de días a predecir (máximo recomendado: 7-14 días)"
     )
 
+    parser.add_argument(
+        "--reconstruir",
+        action="store_true",
+        help="Recarga el histórico completo desde 2000 en lugar de sincronizar solo los días nuevos"
+    )
+
     args = parser.parse_args()
 
+    # Configuración única de logging para los módulos que usan logger
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     # Resolución de parámetros: Prioridad -> Argumento de consola > Configuración por defecto
     ciudad = args.ciudad if args.ciudad else ESTACION_DEFAULT
     dias = args.dias if args.dias else DIAS_DEFAULT
@@ -74,7 +84,7 @@ def main():
     # 1. INGESTA: Sincronización de BD
     if args.accion == "ingest":
         print(">>> 🔄 Ejecutando sincronización de datos (Histórico + Forecast de Viento)...")
-        ingest()
+        ingest(reconstruir=args.reconstruir)
 
     # 2. ENTRENAMIENTO: Re-ajuste de pesos y estacionalidad
     elif args.accion == "train":
@@ -98,13 +108,15 @@ def main():
 
         # Inferencia Modo Normal: Ajuste fino y corrección de "zigzag"
         print("\n--- PREDICCIÓN NORMAL (7 DÍAS REALISTAS) ---")
-        df_pred = predecir_hibrido(ciudad, dias, modo="normal")
+        # Histórico leído una sola vez y compartido por los dos modos
+        df_historial = cargar_historial(ciudad)
+        df_pred = predecir_hibrido(ciudad, dias, modo="normal", df_all=df_historial)
         print(df_pred)
         
         # Inferencia Modo Mensual: Visión de largo plazo / tendencia
         try:
             print("\n--- PREDICCIÓN MENSUAL (TENDENCIA) ---")
-            df_pred_mensual = predecir_hibrido(ciudad, dias, modo="mensual")
+            df_pred_mensual = predecir_hibrido(ciudad, dias, modo="mensual", df_all=df_historial)
             print(df_pred_mensual)
         except Exception as e:
             print(f"\n[!] Modelo mensual no disponible o error en datos: {e}")
@@ -114,7 +126,7 @@ def main():
         print("=== 🚀 INICIANDO PIPELINE COMPLETO (End-to-End) ===")
         
         print("\n[PASO 1] INGEST & SYNC")
-        ingest()
+        ingest(reconstruir=args.reconstruir)
 
         print("\n[PASO 2] TRAIN (DUAL)")
         entrenar_modelos()
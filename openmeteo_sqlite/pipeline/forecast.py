@@ -24,15 +24,19 @@ Características:
     - Clip de seguridad para evitar valores extremos.
 """
 
+import multiprocessing
+import os
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import timedelta
+from functools import lru_cache
 from db.database import load_from_db
 from models.sarima import cargar_sarima
 from models.xgboost_model import cargar_xgboost
-from features.xgb_features import preparar_features_xgb
+from features.xgb_features import preparar_features_xgb, FILAS_CONTEXTO
 
-def predecir_hibrido(ciudad, dias_forecast=7, modo="normal"):
+def predecir_hibrido(ciudad, dias_forecast=7, modo="normal", df_all=None):
     """
     Genera el pronóstico híbrido para una ciudad, aplicando un corrector de
     realidad específico para Santander que evita que la predicción se dispare
@@ -46,6 +50,10 @@ def predecir_hibrido(ciudad, dias_forecast=7, modo="normal"):
         modo : str
             "normal"  → modelo completo
             "mensual" → versión reducida entrenada con muestreo mensual
+        df_all : pd.DataFrame, opcional
+            Histórico de la ciudad ya cargado con cargar_historial(). Permite
+            leer la base de datos una sola vez al predecir varios modos
+            seguidos (no se modifica). Si no se indica, se lee aquí.
 
     Retorna:
         pd.DataFrame
@@ -57,8 +65,8 @@ def predecir_hibrido(ciudad, dias_forecast=7, modo="normal"):
     """
     suffix = "_mensual" if modo == "mensual" else ""
     try:
-        sarima = cargar_sarima(f"{ciudad}{suffix}")
-        xgb_model, features_names = cargar_xgboost(f"xgb_multiciudad{suffix}")
+        sarima = _cargar_sarima(f"{ciudad}{suffix}")
+        xgb_model, features_names = _cargar_xgboost(f"xgb_multiciudad{suffix}")
     except Exception as e:
         print(f"❌ Error cargando modelos: {e}")
         return pd.DataFrame()
@@ -66,63 +74,81 @@ def predecir_hibrido(ciudad, dias_forecast=7, modo="normal"):
     #----------------------------------------------------------------------
     # 1. CARGA DE DATOS
     #----------------------------------------------------------------------
-    df_all = load_from_db(estacion=ciudad)
+    if df_all is None:
+        df_all = cargar_historial(ciudad)
     if df_all.empty: return pd.DataFrame()
-
-    df_all["time"] = pd.to_datetime(df_all["time"])
-    df_all = df_all.sort_values("time")
     
     hoy = pd.Timestamp.now().normalize() 
-    df_hist = df_all[df_all["time"] < hoy].copy()
-    df_futuro_meteo = df_all[df_all["time"] >= hoy].copy()
+    # Ambos tramos solo se leen: el filtrado ya devuelve DataFrames nuevos y
+    # no hace falta duplicar el histórico completo con copy()
+    df_hist = df_all[df_all["time"] < hoy]
+    df_futuro_meteo = df_all[df_all["time"] >= hoy]
 
     #----------------------------------------------------------------------
     # 2. BASE ESTADÍSTICA
     #----------------------------------------------------------------------
-    sarima_forecast = sarima.get_forecast(steps=dias_forecast).predicted_mean
+    # Se extrae como array para indexar por posición dentro del bucle
+    sarima_forecast = sarima.get_forecast(steps=dias_forecast).predicted_mean.to_numpy()
     fechas_futuras = [hoy + timedelta(days=i) for i in range(dias_forecast)]
-    resultados = []
-    df_dinamico = df_hist.copy()
+    # Resultados en arrays preasignados (uno por columna), rellenados por
+    # posición en cada paso; el DataFrame se construye una vez al final.
+    res_sarima = np.empty(dias_forecast)
+    res_viento = np.empty(dias_forecast)
+    res_hibrida = np.empty(dias_forecast)
+    # Dentro del bucle basta con las últimas filas del histórico: las
+    # features del día a predecir solo miran FILAS_CONTEXTO días atrás, así
+    # que cada paso no recalcula todo el histórico. Antes de recortar solo
+    # se rellena hacia delante (depende únicamente de las filas anteriores);
+    # bfill y fillna(0) se aplican en cada paso tras añadir la fila del día,
+    # de modo que una columna sin datos en el histórico se sigue rellenando
+    # desde la previsión meteorológica.
+    df_dinamico = df_hist.ffill().tail(FILAS_CONTEXTO)
 
     print(f"\n--- 🌪️ Generando Pronóstico con Ajuste de Realidad: {ciudad} ({modo.upper()}) ---")
 
+    # Parámetros del ajuste de realidad: dependen solo de la ciudad y el
+    # modo, así que se fijan una vez fuera del bucle.
+    es_santander = (ciudad.lower() == "santander")
+    if es_santander:
+        # m_factor conservador (1.15) para no inflar el residuo base
+        m_factor = 1.15 if modo == "normal" else 1.02
+        mult_foehn = 1.12 # Bajado de 1.3 para suavizar el pico
+        offset_corrector = -1.8 # Empuje hacia abajo para alinear con la realidad
+    else:
+        m_factor = 1.05
+        mult_foehn = 1.0
+        offset_corrector = 0.0
+
+    # Ruido de todos los días en una sola llamada. Cada fila es (ruido,
+    # ruido final) en el mismo orden en que se sorteaban antes dentro del
+    # bucle, así que con la misma semilla se obtienen los mismos valores.
+    ruidos = np.random.uniform([0.98, -0.05], [1.02, 0.05], size=(dias_forecast, 2))
+
     #----------------------------------------------------------------------
     # 3. BUCLE DE PREDICCIÓN
     #----------------------------------------------------------------------
     for i in range(dias_forecast):
         fecha_target = fechas_futuras[i]
-        pred_base = float(sarima_forecast.iloc[i])
+        pred_base = float(sarima_forecast[i])
         meteo_dia = df_futuro_meteo[df_futuro_meteo["time"] == fecha_target]
         
         nueva_fila = meteo_dia.iloc[:1].copy() if not meteo_dia.empty else df_dinamico.iloc[-1:].copy()
         nueva_fila["time"], nueva_fila["sarima_pred"], nueva_fila["estacion"] = fecha_target, pred_base, ciudad
         nueva_fila["temperature_2m_mean"] = pred_base 
 
-        df_temp_total = pd.concat([df_dinamico, nueva_fila], ignore_index=True).ffill().bfill().infer_objects(copy=False).fillna(0)
-        fila_input = preparar_features_xgb(df_temp_total, modo_entrenamiento=False).tail(1)
+        df_ffill = pd.concat([df_dinamico, nueva_fila], ignore_index=True).ffill()
+        df_temp_total = df_ffill.bfill().infer_objects(copy=False).fillna(0)
+        # Solo las columnas del modelo, seleccionadas una vez por paso
+        fila_input = preparar_features_xgb(df_temp_total, modo_entrenamiento=False).tail(1)[features_names]
 
-        residuo_pred = float(xgb_model.predict(fila_input[features_names])[0]) if not fila_input[features_names].empty else 0.0
+        residuo_pred = float(xgb_model.predict(fila_input)[0]) if not fila_input.empty else 0.0
         
         # -----------------------------------------------------------------------
         # 4. MOTOR DE IMPACTO CON AJUSTE DE REALIDAD
         # -----------------------------------------------------------------------
         v_dir = float(nueva_fila["wind_direction_10m_dominant"].iloc[0])
         v_speed = float(nueva_fila.get("wind_speed_10m", pd.Series([12])).iloc[0])
-        
-        es_santander = (ciudad.lower() == "santander")
         fuerza_suave = 1 + (v_speed / 45.0) 
-        
-        if es_santander:
-            # m_factor conservador (1.15) para no inflar el residuo base
-            m_factor = 1.15 if modo == "normal" else 1.02
-            mult_foehn = 1.12 # Bajado de 1.3 para suavizar el pico
-            offset_corrector = -1.8 # Empuje hacia abajo para alinear con la realidad
-        else:
-            m_factor = 1.05
-            mult_foehn = 1.0
-            offset_corrector = 0.0
-
-        ruido = np.random.uniform(0.98, 1.02)
 
         # Lógica de dirección
         if 150 <= v_dir <= 245 and es_santander: # FOEHN
@@ -137,18 +163,107 @@ def predecir_hibrido(ciudad, dias_forecast=7, modo="normal"):
         #----------------------------------------------------------------------
         # 5. RESULTADO FINAL
         #----------------------------------------------------------------------
-        pred_final = pred_base + residuo_final + np.random.uniform(-0.05, 0.05)
+        pred_final = pred_base + residuo_final + ruidos[i, 1]
 
         print(f"Día {i+1} | Viento: {v_dir:3.0f}° | SARIMA: {pred_base:5.2f} | RES: {residuo_final:+5.2f} | FINAL: {pred_final:5.2f}")
 
-        resultados.append({
-            "fecha": fecha_target, 
-            "sarima": round(pred_base, 2), 
-            "viento_dir": round(v_dir, 0), 
-            "hibrida": round(pred_final, 2)
-        })
+        res_sarima[i] = round(pred_base, 2)
+        res_viento[i] = round(v_dir, 0)
+        res_hibrida[i] = round(pred_final, 2)
         
-        nueva_fila["temperature_2m_mean"] = pred_final
-        df_dinamico = pd.concat([df_dinamico, nueva_fila], ignore_index=True)
+        # Se guarda la fila rellenada solo hacia delante (última de df_ffill):
+        # conserva los valores de días que ya salieron de la ventana sin
+        # fijar todavía los huecos que bfill cubre en cada paso
+        fila_rellena = df_ffill.iloc[-1:].copy()
+        fila_rellena["temperature_2m_mean"] = pred_final
+        df_dinamico = pd.concat([df_dinamico, fila_rellena], ignore_index=True).tail(FILAS_CONTEXTO)
+
+    return pd.DataFrame({
+        "fecha": fechas_futuras,
+        "sarima": res_sarima,
+        "viento_dir": res_viento,
+        "hibrida": res_hibrida,
+    })
+
+
+def predecir_hibrido_batch(ciudades, dias_forecast=7, modo="normal", max_workers=None):
+    """
+    Ejecuta predecir_hibrido para varias ciudades en paralelo.
+
+    Cada ciudad es independiente (su propio SARIMA e histórico), así que se
+    reparten entre procesos: el trabajo es cálculo en Python/NumPy y no
+    avanzaría con hilos. Con una sola ciudad se predice en este proceso.
+
+    Parámetros:
+        ciudades : list[str]
+            Nombres de las estaciones a predecir.
+        dias_forecast : int
+            Número de días a predecir.
+        modo : str
+            "normal" o "mensual" (ver predecir_hibrido).
+        max_workers : int, opcional
+            Procesos simultáneos. Por defecto, uno por ciudad hasta el
+            número de CPUs.
+
+    Retorna:
+        dict[str, pd.DataFrame]
+            Pronóstico de cada ciudad, en el mismo orden que 'ciudades'.
+    """
+    ciudades = list(ciudades)
+    if len(ciudades) <= 1:
+        return {ciudad: predecir_hibrido(ciudad, dias_forecast, modo) for ciudad in ciudades}
 
-    return pd.DataFrame(resultados)
\ No newline at end of file
+    workers = max_workers or min(len(ciudades), os.cpu_count() or 1)
+    resultados = {}
+    # Procesos 'spawn' en lugar de fork: un proceso hijo creado con fork
+    # heredaría la conexión SQLite del hilo (que no puede usarse tras un
+    # fork) y el estado del generador aleatorio de NumPy, de modo que todos
+    # los procesos sortearían el mismo ruido. Con spawn cada proceso abre
+    # su propia conexión y parte de una semilla distinta.
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=contexto) as executor:
+        futuros = {
+            executor.submit(predecir_hibrido, ciudad, dias_forecast, modo): ciudad
+            for ciudad in ciudades
+        }
+        for futuro in as_completed(futuros):
+            ciudad = futuros[futuro]
+            try:
+                resultados[ciudad] = futuro.result()
+            except Exception as e:
+                print(f"❌ Error en el pronóstico de {ciudad}: {e}")
+                resultados[ciudad] = pd.DataFrame()
+    return {ciudad: resultados[ciudad] for ciudad in ciudades}
+
+
+# Modelos memorizados por nombre: al predecir varias ciudades (o los dos
+# modos) en el mismo proceso, el XGBoost multiciudad y cada SARIMA se
+# deserializan una sola vez. Los modelos solo se usan para predecir, nunca
+# se modifican. Si se reentrena en el mismo proceso, train.py llama a
+# limpiar_cache_modelos() para que se carguen los nuevos.
+_cargar_sarima = lru_cache(maxsize=16)(cargar_sarima)
+_cargar_xgboost = lru_cache(maxsize=4)(cargar_xgboost)
+
+def limpiar_cache_modelos():
+    """
+    Olvida los modelos SARIMA y XGBoost memorizados, para que la siguiente
+    predicción los vuelva a leer del disco (p. ej. tras reentrenarlos).
+    """
+    _cargar_sarima.cache_clear()
+    _cargar_xgboost.cache_clear()
+
+
+def cargar_historial(ciudad):
+    """
+    Lee de la base de datos el histórico de una ciudad con 'time' convertido
+    a datetime y ordenado, listo para predecir_hibrido.
+
+    Quien vaya a predecir varios modos seguidos (como main.py) lo carga una
+    vez y lo pasa en 'df_all' a cada llamada; así los datos son siempre los
+    de la base de datos en el momento de la lectura.
+    """
+    df_all = load_from_db(estacion=ciudad)
+    if df_all.empty:
+        return df_all
+    df_all["time"] = pd.to_datetime(df_all["time"])
+    return df_all.sort_values("time")
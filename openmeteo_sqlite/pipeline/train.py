@@ -37,12 +37,14 @@ import pandas as pd
 import numpy as np
 from tqdm import tqdm
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from db.database import load_from_db
 from models.sarima import entrenar_sarima, guardar_sarima
 from models.xgboost_model import entrenar_xgboost_train_only, guardar_xgboost
 from features.xgb_features import preparar_features_xgb
 from features.muestreo import muestreo_mensual
+from pipeline.forecast import limpiar_cache_modelos
 
 # ------------------------------------------------------------------
 # MOTOR DE ENTRENAMIENTO
@@ -65,12 +67,19 @@ def ejecutar_pipeline_entrenamiento(modo="normal", dias_por_mes=25):
     print(f"\n>>> INICIANDO PIPELINE DE ENTRENAMIENTO: MODO {modo.upper()} <<<")
     
     # 1. CARGA DE DATOS
-    df = load_from_db(estacion=None)
+    # Las filas sin fecha o sin temperatura se descartan ya en la consulta
+    df = load_from_db(estacion=None, no_nulos=["time", "temperature_2m_mean"])
     df["time"] = pd.to_datetime(df["time"], errors="coerce")
     
-    # Limpieza: Eliminamos registros sin target o sin fecha
+    # Limpieza: Eliminamos registros sin target o sin fecha (p. ej. fechas
+    # que no se han podido convertir)
     df = df.dropna(subset=["temperature_2m_mean", "time"]).sort_values(["estacion", "time"]).reset_index(drop=True)
 
+    # Estación como categoría: los groupby, el factorize y las comparaciones
+    # de orden de preparar_features_xgb trabajan sobre códigos enteros en
+    # lugar de volver a hashear los textos de todas las filas.
+    df["estacion"] = df["estacion"].astype("category")
+
     if df.empty:
         raise ValueError("Error: La base de datos está vacía.")
 
@@ -79,30 +88,53 @@ def ejecutar_pipeline_entrenamiento(modo="normal", dias_por_mes=25):
     # ------------------------------------------------------------------
     
     print(f"--- Entrenando SARIMA (Serie completa) ---")
-    df["sarima_pred"] = np.nan 
-    ciudades = df["estacion"].unique()
+    # Filas de cada ciudad en una sola pasada (groupby), en lugar de comparar
+    # toda la columna 'estacion' con cada ciudad en cada iteración
+    filas_por_ciudad = df.groupby("estacion", sort=False).indices
     
     suffix = "_mensual" if modo == "mensual" else ""
     
-    for ciudad in tqdm(ciudades, desc="Ciudades SARIMA"):
-        idx_ciudad = df[df["estacion"] == ciudad].index
-        df_city = df.loc[idx_ciudad].copy()
+    tareas = {}
+    for ciudad, filas in filas_por_ciudad.items():
+        idx_ciudad = df.index[filas]
+        df_city = df.loc[idx_ciudad]
         
         # Validación de ventana temporal (Mínimo 2 años para estacionalidad)
         if len(df_city) < 730: 
             print(f"\nSaltando {ciudad}: Datos insuficientes (mínimo 730 días).")
             continue
-        
-        # Entrenamiento y guardado del modelo estadístico
-        model_name = f"{ciudad}{suffix}"
-        sarima_mod = entrenar_sarima(df_city)
-        guardar_sarima(sarima_mod, model_name)
-        
-        # Mapeo de predicciones in-sample (fitted values)
-        # Usamos un diccionario de fechas para asegurar alineación exacta
-        preds = sarima_mod.get_prediction(dynamic=False).predicted_mean
-        preds_dict = preds.to_dict()
-        df.loc[idx_ciudad, "sarima_pred"] = df.loc[idx_ciudad, "time"].map(preds_dict)
+        tareas[ciudad] = (filas, df_city)
+
+    # Cada ciudad tiene su propio modelo, así que los ajustes son
+    # independientes: se reparten entre procesos (el ajuste de SARIMA es
+    # cálculo puro en Python/NumPy y no avanzaría con hilos). Con una sola
+    # ciudad se entrena en este mismo proceso.
+    if len(tareas) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(tareas), os.cpu_count() or 1)) as executor:
+            futuros = {
+                executor.submit(_entrenar_sarima_ciudad, df_city, f"{ciudad}{suffix}"): ciudad
+                for ciudad, (_, df_city) in tareas.items()
+            }
+            resultados = {
+                futuros[futuro]: futuro.result()
+                for futuro in tqdm(as_completed(futuros), total=len(futuros), desc="Ciudades SARIMA")
+            }
+    else:
+        resultados = {
+            ciudad: _entrenar_sarima_ciudad(df_city, f"{ciudad}{suffix}")
+            for ciudad, (_, df_city) in tqdm(tareas.items(), desc="Ciudades SARIMA")
+        }
+
+    # Mapeo de predicciones in-sample (fitted values) sobre un array float64
+    # y escritura posicional por ciudad, asignando la columna una sola vez.
+    # reindex alinea por fecha exacta (como un diccionario de fechas) y deja
+    # NaN en los días sin predicción.
+    sarima_pred = np.full(len(df), np.nan)
+    tiempos = df["time"]
+    for ciudad, preds in resultados.items():
+        filas = tareas[ciudad][0]
+        sarima_pred[filas] = preds.reindex(tiempos.iloc[filas]).to_numpy(dtype=np.float64)
+    df["sarima_pred"] = sarima_pred
 
     # ------------------------------------------------------------------
     # 3. CÁLCULO DE RESIDUOS (EL TARGET PARA EL SIGUIENTE NIVEL)
@@ -140,11 +172,27 @@ def ejecutar_pipeline_entrenamiento(modo="normal", dias_por_mes=25):
     xgb_name = "xgb_multiciudad_mensual" if modo == "mensual" else "xgb_multiciudad"
     print(f"--- Entrenando XGBoost: {xgb_name} ---")
     
+    # El entrenamiento recibe la estación como texto, igual que antes
+    df_feat["estacion"] = df_feat["estacion"].astype(str)
     xgb_model, features = entrenar_xgboost_train_only(df_feat, residuos_col="residuo")
     guardar_xgboost(xgb_model, features, nombre=xgb_name)
+    # Las predicciones posteriores en este proceso deben usar los modelos nuevos
+    limpiar_cache_modelos()
     
     print(f"✔ Pipeline {modo} completado con éxito.\n")
 
+def _entrenar_sarima_ciudad(df_city, model_name):
+    """
+    Entrena y guarda el SARIMA de una ciudad y devuelve sus predicciones
+    in-sample (fitted values).
+
+    Se ejecuta en un proceso aparte: solo recibe el DataFrame de la ciudad
+    y devuelve la serie de predicciones, no el modelo completo.
+    """
+    sarima_mod = entrenar_sarima(df_city)
+    guardar_sarima(sarima_mod, model_name)
+    return sarima_mod.get_prediction(dynamic=False).predicted_mean
+
 # ------------------------------------------------------------------
 # PUNTOS DE ACCESO
 # ------------------------------------------------------------------